@@ -1,16 +1,28 @@
 from flask import Flask, request, render_template, jsonify, session, redirect, url_for, Response, stream_with_context
 from flask_session import Session 
 import pandas as pd
-from lib.utils import is_sheet_small, encode_image, convert_to_pdf, page_number_mapping, get_img_from_pg_num, convert_to_csv, get_img_from_csv
-from lib.util_agent import small_sheet_query_agent, search_term_extraction_agent, table_list, search_term_query_correction_agent, query_writer_agent, response_humanizer_agent, reset_usage, reset_logs
+from lib.utils import page_number_mapping, rasterize_pdf_pages
+from lib.image_prep import prepare_images
+from lib.sheet_text import serialize_small_sheets, sheets_needing_images
+from lib.context_cache import workbook_context
+from lib.sql_engine import run_queries
+from lib.result_compaction import compact_results
+from lib.fast_answer import fast_answer_text, stream_fast_answer
+from lib.artifacts import table_artifacts, warm_artifacts, ARTIFACT_WARMUP
+from lib.util_agent import small_sheet_query_agent, search_term_extraction_agent, table_list, search_term_query_correction_agent, query_writer_agent, response_humanizer_agent, reset_usage, reset_logs, fewshot_subterm_lists
+from lib.usage_tracker import begin_usage, flush_usage, usage_rollup
+from lib.llm_gateway import gateway_stats
+from lib.registry import lookup_indexed_workbook, registry_record, file_checksum as checksum_file
+from lib.sheet_profile import profile_workbook, sheets_by_class, pdf_page_mapping
+from lib.ingest import open_workbook, bulk_load_connect, bulk_load_sheets, finalize_database, open_readonly, export_table_csv, build_fuzzy_search
+from lib.pipeline import pipeline_stage, run_pipeline
+from lib.soffice_pool import convert_workbook_pdf, pdf_sheet_order, pool_stats
+from lib.uploads import safe_filename, stream_upload, upload_spool_path, upload_offset, append_upload_chunk, max_upload_bytes, UploadTooLarge
 import json
 import uuid
 from dotenv import load_dotenv
 import os
-from openpyxl import load_workbook
-import hashlib
-import glob
-import sqlite3
+import shutil
 
 load_dotenv()
 
@@ -18,6 +30,8 @@ app = Flask(__name__)
 app.config["SESSION_PERMANENT"] = False
 app.config["SESSION_TYPE"] = "filesystem"
 app.secret_key = os.urandom(24)  # Generate a random secret key
+# reject oversized requests before werkzeug spools them, leaving room for the form fields
+app.config["MAX_CONTENT_LENGTH"] = max_upload_bytes() + 1024 * 1024
 Session(app)
 
 '''
@@ -61,191 +75,298 @@ def index():
 def upload_file():
 
     def generate_response():
-        file = {}
-        if 'file' not in request.files:
-            yield json.dumps({'error': 'No file part'}).encode() + b'\n' 
-            return
-        file = request.files['file']
-        if file.filename == '':
+        upload_id = request.form.get('upload_id', '')
+        if upload_id:
+            # finalize a chunked upload that was sent through /upload/chunk
+            spool_path = upload_spool_path(upload_id)
+            if spool_path is None or not os.path.exists(spool_path):
+                yield json.dumps({'error': 'Unknown upload id'}).encode() + b'\n'
+                return
+            filename = safe_filename(request.form.get('filename', ''))
+        else:
+            if 'file' not in request.files:
+                yield json.dumps({'error': 'No file part'}).encode() + b'\n' 
+                return
+            file = request.files['file']
+            filename = safe_filename(file.filename)
+        if filename == '':
             yield json.dumps({'error': 'No selected file'}).encode() + b'\n'
             return
-        if file:
-            yield json.dumps({'success': 'Uploading the workbook. Please wait!'}).encode() + b'\n'
-            # Calculate the file checksum
-            file_content = file.read()
-            file_checksum = hashlib.md5(file_content).hexdigest()
-            file.seek(0)  # Reset file pointer to the beginning
-
-            # Check if the file has already been processed
-            existing_files = glob.glob('temp_files/**/*.xlsx', recursive=True)
-            for existing_file in existing_files:
-                with open(existing_file, 'rb') as f:
-                    existing_file_content = f.read()
-                    existing_file_checksum = hashlib.md5(existing_file_content).hexdigest()
-                    if existing_file_checksum == file_checksum:
-                        existing_cuuid = existing_file.split('/')[1]
-                        # load the metadata file
-                        metadata_file_path = f'temp_files/{existing_cuuid}/{existing_cuuid}_metadata.json'
-                        if os.path.exists(metadata_file_path):    
-                            file_metadata = {}
-                            with open(metadata_file_path, 'r') as f:
-                                file_metadata = json.load(f)
-                            if 'cuuid' in file_metadata:
-                                yield json.dumps({'success': 'indexed', 'cuuid': existing_cuuid}).encode() + b'\n'
-                                return
-
-            # load the workbook
-            yield json.dumps({'success': 'Uploading the workbook. Please wait!'}).encode() + b'\n'
-            print("Uploading the workbook. Please wait!")
-
-            # create file paths and ids for tracking
-            current_uuid = str(uuid.uuid4())
-
-            # create a directory for the current file
-            os.makedirs(f'temp_files/{current_uuid}', exist_ok=True)
-            file_path = f'temp_files/{current_uuid}/{file.filename}'
-            file.save(file_path)
 
+        yield json.dumps({'success': 'Uploading the workbook. Please wait!'}).encode() + b'\n'
+        print("Uploading the workbook. Please wait!")
+
+        # create file paths and ids for tracking
+        current_uuid = str(uuid.uuid4())
+
+        # create a directory for the current file
+        os.makedirs(f'temp_files/{current_uuid}', exist_ok=True)
+        file_path = f'temp_files/{current_uuid}/{filename}'
+
+        # spool the upload to disk in chunks, the checksum is computed in the same pass
+        if upload_id:
+            file_checksum = checksum_file(spool_path)
+            os.replace(spool_path, file_path)
+        else:
+            try:
+                file_checksum, _ = stream_upload(file.stream, f'{file_path}.part')
+            except UploadTooLarge as e:
+                shutil.rmtree(f'temp_files/{current_uuid}', ignore_errors=True)
+                yield json.dumps({'error': str(e)}).encode() + b'\n'
+                return
+            os.replace(f'{file_path}.part', file_path)
+
+        # Check if the file has already been processed
+        existing_cuuid = lookup_indexed_workbook(file_checksum)
+        if existing_cuuid is not None:
+            shutil.rmtree(f'temp_files/{current_uuid}', ignore_errors=True)
+            yield json.dumps({'success': 'indexed', 'cuuid': existing_cuuid}).encode() + b'\n'
+            return
+        registry_record(file_checksum, current_uuid, 'indexing', file_path)
+
+        # from here on a failure of any kind, a corrupt upload included, must not leave a stuck 'indexing' entry
+        workbook = None
+        try:
             file_metadata = {
                 "excel_file_path": file_path,
                 "cuuid": "",
                 "pdf_file_path": "",
+                "sheet_profiles": {},
                 "small_sheets": {
-                    "encoded_images_json": ""
+                    "image_manifest": "",
+                    "text_manifest": ""
                 },
                 "big_sheets": {
                     "csv_file_meta": [],
-                    "sqllite_db_path": ""
+                    "sqllite_db_path": "",
+                    "search_index_path": "",
+                    "cell_store_dir": "",
+                    "fewshot_subterms": {},
+                    "schema_catalog": {}
                 }
             }
 
-            # load to openpyxl for smaller sheets filtering
-            workbook = load_workbook(file_path)
+            # open read-only and profile every sheet once, every later stage reads the profile
+            workbook = open_workbook(file_path)
+            file_metadata['sheet_profiles'] = profile_workbook(workbook)
+            small_sheets = sheets_by_class(workbook, file_metadata['sheet_profiles'], 'small')
+            big_sheets = sheets_by_class(workbook, file_metadata['sheet_profiles'], 'big')
             yield json.dumps({'success': 'Indexing: Workbook uploaded, now processing sheets. Please wait!'}).encode() + b'\n'
             print("Indexing: Workbook uploaded, now processing sheets. Please wait!")
 
-            # complete workbook to pdf conversion
-            file_metadata['pdf_file_path'] = convert_to_pdf(file_path, current_uuid)
-
             # workbook page mapping
             page_mapping = page_number_mapping(workbook.sheetnames)
 
-            def process_small_sheets():
-                small_sheet_images_paths = []
-                for pg_num in [page_mapping[sheet_name] for sheet_name in [sheet.title for sheet in workbook if is_sheet_small(sheet)]]:
-                    small_sheet_images_paths.append(get_img_from_pg_num(file_metadata['pdf_file_path'], pg_num, page_mapping, current_uuid))
-
-                # small sheet images encoder
-                small_sheet_images_context_array = []
-                for img in small_sheet_images_paths:
-                    if img is not None:
-                        image_base64 = encode_image(img)
-                        image_encoding = f"data:image/jpeg;base64,{image_base64}"
-                        small_sheet_images_context_array.append({
-                            "image_path": img,
-                            "image_encoding": image_encoding,
-                        })
-                # save the images context array
-                file_metadata['small_sheets']['encoded_images_json'] = f'temp_files/{current_uuid}/small_sheet_images_context_array.json'
-                with open(file_metadata['small_sheets']['encoded_images_json'], 'w') as f:
-                    json.dump(small_sheet_images_context_array, f)
-
-            def process_big_sheets():
-                # csv generation & sample image extraction
-                for sheet in workbook:
-                    if is_sheet_small(sheet, return_big_sheets=True):
-                        csv_file = f'temp_files/{current_uuid}/{sheet.title}.csv'
+            # small sheets as markdown grids; only the ones text cannot stand in for are rendered below
+            image_sheets = []
+            if small_sheets:
+                file_metadata['small_sheets']['text_manifest'] = serialize_small_sheets(
+                    workbook, file_path, [sheet.title for sheet in small_sheets], f'temp_files/{current_uuid}/small_sheet_text.json'
+                )
+                with open(file_metadata['small_sheets']['text_manifest'], 'r') as f:
+                    needs_image = sheets_needing_images(json.load(f))
+                image_sheets = [sheet for sheet in small_sheets if sheet.title in needs_image]
+
+            # pages of a full pdf export count printed sheets only, not workbook positions
+            pdf_pages = pdf_page_mapping(file_metadata['sheet_profiles'])
+            small_sheet_pages = {sheet.title: pdf_pages.get(sheet.title) for sheet in image_sheets}
+
+            def convert_workbook():
+                # only the small sheets that need an image are exported, one page each
+                file_metadata['pdf_file_path'], elapsed, method = convert_workbook_pdf(file_path, f'temp_files/{current_uuid}/', small_sheet_pages)
+                file_metadata['pdf_conversion'] = {"seconds": round(elapsed, 3), "method": method}
+
+            small_sheet_images = {}
+
+            def render_small_sheets():
+                # a sheet the export left out (hidden, on the cli path) simply gets no image
+                exported = pdf_sheet_order(small_sheet_pages, file_metadata['pdf_conversion']['method'])
+                small_sheet_images.update(rasterize_pdf_pages(file_metadata['pdf_file_path'], exported, page_mapping, current_uuid))
+
+            def save_small_sheet_images():
+                # trimmed, budget-sized image files plus a manifest, encoded only when a question is asked
+                file_metadata['small_sheets']['image_manifest'] = prepare_images(
+                    {sheet.title: small_sheet_images.get(sheet.title) for sheet in image_sheets},
+                    f'temp_files/{current_uuid}/small_sheet_images'
+                )
+
+            def load_big_sheets():
+                # bulk load every big sheet into sqlite in a single transaction
+                conn = bulk_load_connect(file_metadata['big_sheets']['sqllite_db_path'])
+                try:
+                    for schema in bulk_load_sheets(conn, big_sheets, file_metadata['sheet_profiles']):
+                        file_metadata['big_sheets']['schema_catalog'][schema['table_name']] = schema
                         file_metadata['big_sheets']['csv_file_meta'].append({
-                            "sheet_name": sheet.title,
-                            "csv_file_path": convert_to_csv(sheet, csv_file),
-                            "csv_sample_image": get_img_from_csv(csv_file, page_mapping[sheet.title], page_mapping, current_uuid)
+                            "sheet_name": schema['table_name'],
+                            "csv_file_path": ""
                         })
+                    finalize_database(conn)
+                finally:
+                    conn.close()
 
-                # store in sqllite db
+            def export_csv_files():
+                # csv export is optional, nothing downstream needs it anymore
+                conn = open_readonly(file_metadata['big_sheets']['sqllite_db_path'])
+                try:
+                    for csv_meta in file_metadata['big_sheets']['csv_file_meta']:
+                        csv_meta['csv_file_path'] = export_table_csv(conn, csv_meta['sheet_name'], f'temp_files/{current_uuid}/{csv_meta["sheet_name"]}.csv')
+                finally:
+                    conn.close()
+
+            def save_fuzzy_search(result):
+                key, path = result
+                file_metadata['big_sheets'][key] = path
+
+            def save_fewshot_subterms():
+                file_metadata['big_sheets']['fewshot_subterms'] = fewshot_subterm_lists(file_metadata)
+
+            # ingestion as a dependency graph: pdf rendering, the sqlite load and everything hanging off
+            # either of them run concurrently, so indexing takes about as long as the longest chain
+            stages = []
+            if image_sheets:
+                stages.append(pipeline_stage('pdf', convert_workbook))
+                stages.append(pipeline_stage('images', render_small_sheets, deps=['pdf']))
+                stages.append(pipeline_stage('small_sheets', save_small_sheet_images, deps=['images']))
+            if big_sheets:
                 file_metadata['big_sheets']['sqllite_db_path'] = f'temp_files/{current_uuid}/workbook.db'
-                conn = sqlite3.connect(file_metadata['big_sheets']['sqllite_db_path'])
-                for csv_meta in file_metadata['big_sheets']['csv_file_meta']:
-                    df = pd.read_csv(csv_meta['csv_file_path'])
-                    df.to_sql(csv_meta['sheet_name'], conn, if_exists='replace', index=False, method='multi')
-                conn.close()
-
-            # Process small sheets if they exist
-            if any(is_sheet_small(sheet) for sheet in workbook):
-                yield json.dumps({'success': 'Indexing: Processing small sheets. Please wait!'}).encode() + b'\n'
-                print("Indexing: Processing small sheets. Please wait!")
-                process_small_sheets()
-
-            # Process big sheets if they exist
-            if any(is_sheet_small(sheet, return_big_sheets=True) for sheet in workbook):
-                yield json.dumps({'success': 'Indexing: Processing big sheets. Please wait!'}).encode() + b'\n'
-                print("Indexing: Processing big sheets. Please wait!")
-                process_big_sheets()
+                stages.append(pipeline_stage('sqlite', load_big_sheets))
+                stages.append(pipeline_stage(
+                    'fuzzy_search',
+                    build_fuzzy_search,
+                    args=lambda: (file_metadata['big_sheets']['sqllite_db_path'], file_metadata['big_sheets']['csv_file_meta'], f'temp_files/{current_uuid}', os.getenv('FUZZY_SEARCH_BACKEND', 'index')),
+                    deps=['sqlite'],
+                    pool='process',
+                    on_done=save_fuzzy_search
+                ))
+                stages.append(pipeline_stage('fewshot_subterms', save_fewshot_subterms, deps=['fuzzy_search']))
+                if os.getenv('EXPORT_CSV', '0') == '1':
+                    stages.append(pipeline_stage('csv_export', export_csv_files, deps=['sqlite']))
+
+            for event in run_pipeline(stages):
+                if event['status'] == 'failed':
+                    progress = f"Indexing: Stage {event['stage']} failed: {event['error']}"
+                    yield json.dumps({'error': progress, 'stage': event['stage'], 'status': event['status'], 'elapsed': event['elapsed']}).encode() + b'\n'
+                    print(progress)
+                    continue
+                progress = f"Indexing: Stage {event['stage']} {event['status']} in {event['elapsed']:.2f}s"
+                yield json.dumps({'success': progress, 'stage': event['stage'], 'status': event['status'], 'elapsed': event['elapsed']}).encode() + b'\n'
+                print(progress)
+                if event['stage'] == 'pdf' and event['status'] == 'done':
+                    progress = f"Indexing: Converted workbook to pdf in {file_metadata['pdf_conversion']['seconds']:.2f}s ({file_metadata['pdf_conversion']['method']})"
+                    yield json.dumps({'success': progress, 'pdf_conversion': file_metadata['pdf_conversion']}).encode() + b'\n'
+                    print(progress)
+                if event['stage'] == 'sqlite' and event['status'] == 'done':
+                    for schema in file_metadata['big_sheets']['schema_catalog'].values():
+                        progress = f"Indexing: Loaded sheet {schema['table_name']} ({schema['rows']} rows, {schema['rows_per_second']} rows/sec)"
+                        yield json.dumps({'success': progress}).encode() + b'\n'
+                        print(progress)
 
             yield json.dumps({'success': f'Indexing: Processed and encoded all sheets. Saving metadata for user {current_uuid}. Please wait!'}).encode() + b'\n'
             print(f"Indexing: Processed and encoded all sheets. Saving metadata for user {current_uuid}. Please wait!")
 
+            workbook.close()
+            workbook = None
+
             # Adding cuuid to the metadata in the end to indicate successful indexing
             file_metadata['cuuid'] = current_uuid
             # save file_metadata to json
             with open(f'temp_files/{current_uuid}/{current_uuid}_metadata.json', 'w') as f:
                 json.dump(file_metadata, f)
-
-            yield json.dumps({'success': 'indexed', 'cuuid': current_uuid}).encode() + b'\n'
-            print("File indexed")
+        except Exception as e:
+            # a half built index is never handed out: drop its files and mark the registry entry failed
+            if workbook is not None:
+                workbook.close()
+            registry_record(file_checksum, current_uuid, 'failed', file_path)
+            shutil.rmtree(f'temp_files/{current_uuid}', ignore_errors=True)
+            yield json.dumps({'error': f'Indexing failed: {e}'}).encode() + b'\n'
+            print(f"Indexing failed for {current_uuid}: {e}")
             return
 
+        registry_record(file_checksum, current_uuid, 'indexed', file_path)
+        if ARTIFACT_WARMUP and file_metadata['big_sheets']['csv_file_meta']:
+            warm_artifacts(file_metadata)
+
+        yield json.dumps({'success': 'indexed', 'cuuid': current_uuid}).encode() + b'\n'
+        print("File indexed")
+        return
+
     return Response(stream_with_context(generate_response()), content_type='application/json')
 
+@app.route('/upload/chunk', methods=['POST'])
+def upload_chunk():
+    # resumable uploads: the client appends chunks at the offset the server reports
+    upload_id = request.form.get('upload_id') or uuid.uuid4().hex
+    if 'chunk' not in request.files:
+        return jsonify({'error': 'No chunk part'}), 400
+    try:
+        offset, appended = append_upload_chunk(upload_id, int(request.form.get('offset', 0)), request.files['chunk'].stream)
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not appended:
+        return jsonify({'error': 'Offset mismatch', 'upload_id': upload_id, 'offset': offset}), 409
+    return jsonify({'success': 'chunk stored', 'upload_id': upload_id, 'offset': offset}), 200
+
+@app.route('/upload/chunk/<upload_id>', methods=['GET'])
+def upload_chunk_status(upload_id):
+    offset = upload_offset(upload_id)
+    if offset is None:
+        return jsonify({'error': 'Unknown upload id'}), 404
+    return jsonify({'upload_id': upload_id, 'offset': offset}), 200
+
+@app.route('/llm/stats', methods=['GET'])
+def llm_stats():
+    return jsonify(gateway_stats()), 200
+
+@app.route('/soffice/stats', methods=['GET'])
+def soffice_stats():
+    return jsonify(pool_stats()), 200
+
+@app.route('/usage', methods=['GET'])
+def usage_totals():
+    return jsonify(usage_rollup()), 200
+
+@app.route('/usage/<cuuid>', methods=['GET'])
+def workbook_usage_totals(cuuid):
+    return jsonify(usage_rollup(cuuid)), 200
+
 @app.route('/ask', methods=['POST'])
 def ask_question():
-    
+
     def generate_response():
+        # usage is collected in memory for this request only and written once at the end
+        usage = begin_usage(request.form['cuuid'])
+        try:
+            yield from answer_question()
+        finally:
+            flush_usage(usage)
+    
+    def answer_question():
         question = request.form['question']
         cuuid = request.form['cuuid']
 
-        metadata_file_path = f'temp_files/{cuuid}/{cuuid}_metadata.json'
-        
-        if os.path.exists(metadata_file_path):
-            with open(metadata_file_path, 'r') as f:
-                file_metadata = json.load(f)
-                if 'cuuid' not in file_metadata:
-                    yield json.dumps({'error': 'File not indexed yet'}).encode() + b'\n'
-                    return
+        # parsed metadata, small sheet payloads and the database connection come from the workbook cache
+        context = workbook_context(cuuid)
+        if context is None or 'cuuid' not in context['metadata']:
+            yield json.dumps({'error': 'File not indexed yet'}).encode() + b'\n'
+            return
 
         reset_usage(cuuid)
         reset_logs(cuuid)
         yield json.dumps({'success': 'Analyzing: Processing the query. Please wait!', 'action': "processing"}).encode() + b'\n'
 
-        # load metadata
-        metadata = {}
-        with open(f'temp_files/{cuuid}/{cuuid}_metadata.json', 'r') as f:
-            metadata = json.load(f)
-        
+        metadata = context['metadata']
+
         yield json.dumps({'success': 'Analyzing: Checking against small sheets. Please wait!', 'action': "processing"}).encode() + b'\n'
         # check against small sheets first, if they exist
-        small_sheet_images = {}
-        if len(metadata['small_sheets']['encoded_images_json']) > 0:
-            # check if metadata['small_sheets']['encoded_images_json'] exists
-            if os.path.exists(metadata['small_sheets']['encoded_images_json']):
-                with open(metadata['small_sheets']['encoded_images_json'], 'r') as f:
-                    small_sheet_images = json.load(f)
-
-                # check if the question can be answered from small sheets
-                message_image_array = []
-                for img in small_sheet_images:
-                    message_image_array.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": img['image_encoding']
-                        }
-                    })
-                
-                # call small sheet agent
-                small_sheet_response = small_sheet_query_agent(question, message_image_array, cuuid)
-                if small_sheet_response != 'no_answer_found':
-                    yield from response_humanizer_agent(question, small_sheet_response, cuuid)
-                    return
-        
+        if context['image_parts'] or context['sheet_texts']:
+            # call small sheet agent
+            small_sheet_response = small_sheet_query_agent(question, context['image_parts'], cuuid, context['sheet_texts'])
+            if small_sheet_response != 'no_answer_found':
+                yield from response_humanizer_agent(question, small_sheet_response, cuuid)
+                return
+
         # check against big sheets, if they exist
         yield json.dumps({'success': 'Analyzing: No related data in small sheets, checking against large sheets. Please wait!', 'action': "processing"}).encode() + b'\n'
         if len(metadata['big_sheets']['sqllite_db_path']) > 0:
@@ -255,46 +376,53 @@ def ask_question():
             search_term = search_term_extraction_agent(query=question, cuuid=cuuid)
             question = search_term_query_correction_agent(query=question, search_term=search_term, metadata=metadata, cuuid=cuuid)
             
-            db = sqlite3.connect(metadata['big_sheets']['sqllite_db_path'])
-            cursor = db.cursor()
             search_term_table_names = table_list(metadata=metadata, search_term=search_term)
             table_detail_mapping = {}
+            # table descriptions come from the schema catalog built at index time (or read back for older workbooks)
+            schema_catalog = context['schema_catalog']
             for table in search_term_table_names:
-                for file_meta in metadata['big_sheets']['csv_file_meta']:
-                    if table in file_meta['sheet_name']:
-                        tab_q = f'PRAGMA table_info("{table}")'
-                        cursor.execute(tab_q)
-                        table_description = cursor.fetchall()
-                        for col in table_description:
-                            table_detail_mapping[table] = {}
-                            table_detail_mapping[table]["column_details"] = []
-                            table_detail_mapping[table]["column_details"].append({ 'column_name': col[1], 'column_type': col[2] })
-                        table_detail_mapping[table]["table_name"] = table
-                        table_detail_mapping[table]['sample_image'] = file_meta['csv_sample_image']
-                        break
+                if table not in schema_catalog:
+                    continue
+                # sample artifacts are built the first time a table is routed to, then reused
+                artifacts = table_artifacts(metadata, table)
+                table_detail_mapping[table] = {
+                    "table_name": table,
+                    "row_count": schema_catalog[table].get('rows'),
+                    "column_details": schema_catalog[table]['columns'],
+                    "sample_image": artifacts['sample_image'],
+                    "sample_markdown": artifacts['sample_markdown']
+                }
             yield json.dumps({'success': 'Analyzing: Checking against individual large sheets. Please wait!', 'action': "processing"}).encode() + b'\n'
             multiple_sql_queries = query_writer_agent(question, table_detail_mapping, cuuid)
             
-            # execute all queries, use try except block, put all results in a list
+            # generated queries run side by side on the workbook's read-only pool, results keep the query order
+            runnable = [query for query in multiple_sql_queries if not query.get("error")]
+            outcomes = iter(run_queries(context['sql_pool'], [query.get("query") for query in runnable]))
             results = []
             for query in multiple_sql_queries:
-                try:
-                    print(query["query"])
-                    cursor.execute(query["query"])
-                    result = cursor.fetchall()
-                    print(result)
-                    results.append({
-                        "table_name": query["table_name"],
-                        "query": query["query"],
-                        "result": result
-                    })
-                except Exception as e:
+                if query.get("error"):
                     results.append({
                         "table_name": query["table_name"],
-                        "query": query["query"],
-                        "result": str(e)
+                        "query": None,
+                        "result": f'Query generation failed: {query["error"]}'
                     })
-            db.close()
+                    continue
+                outcome = next(outcomes)
+                print(query.get("query"), outcome['row_count'], outcome['elapsed'], outcome.get('error', ''))
+                results.append({
+                    "table_name": query["table_name"],
+                    "query": query.get("query"),
+                    "result": outcome.get('error', outcome['rows']),
+                    "columns": outcome['columns'],
+                    "row_count": outcome['row_count'],
+                    "truncated": outcome['truncated'],
+                    "elapsed": outcome['elapsed']
+                })
+            results = compact_results(results)
+            answer = fast_answer_text(results)
+            if answer is not None:
+                yield from stream_fast_answer(answer, cuuid)
+                return
             yield from response_humanizer_agent(question, results, cuuid)
             return
 
@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import random
+import tempfile
+import argparse
+from difflib import SequenceMatcher
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.search_index import csv_table_sources, build_search_index, search_index_lookup
+from lib.cell_store import build_cell_store, cell_store_lookup
+
+# usage: python benchmarks/bench_find_approx_text.py --rows 20000 --cols 8
+
+WORDS = ['Construction', 'of', 'Internal', 'Roads', 'at', 'Airport', 'Showroom', 'Zone', 'Duqm', '(Phase', '1)',
+         'Civil', 'Works', 'for', 'Refinery', 'Package', 'Fishery', 'Harbour', 'Khasab', 'Tender', 'Bond', 'Lulu',
+         'Palm', 'Mall', 'Submitted', 'Lost', 'Won', 'Muscat', 'Sohar', 'Salalah']
+
+PLANTED_NAME = 'TENDER-Construction of Internal Roads at Airport Showroom Zone at Duqm (Phase 1)'
+
+def legacy_find_approx_text(csv_files, search_text, threshold=0.8):
+    # find_approx_text as it was before the search index and the cell store
+    df_dict = {f: pd.read_csv(f) for f in csv_files}
+    results = {}
+    for filename, df in df_dict.items():
+        for col in df.columns:
+            for idx, row in df.iterrows():
+                cell_value = str(row[col])
+                words = cell_value.split()
+                for i in range(len(words)):
+                    for j in range(i+1, len(words)+1):
+                        substring = ' '.join(words[i:j])
+                        similarity = SequenceMatcher(None, search_text, substring).ratio()
+                        if similarity >= threshold:
+                            key = (filename, idx, col)
+                            if key not in results or similarity > results[key][1]:
+                                results[key] = (substring, similarity)
+    return [{'filename': f, 'row': i, 'column': c, 'substring': s, 'similarity': sim} for (f, i, c), (s, sim) in results.items()]
+
+def synthetic_sheet(rows, cols, seed=0):
+    rng = random.Random(seed)
+    data = {}
+    for col in range(cols):
+        if col % 4 == 0:
+            # about 1% of the names contain the benchmark search term so the scan has something to find
+            data[f'Tender Name {col}'] = [PLANTED_NAME if rng.random() < 0.01 else ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12))) for _ in range(rows)]
+        elif col % 4 == 1:
+            data[f'Value {col}'] = [round(rng.random() * 1e6, 3) for _ in range(rows)]
+        elif col % 4 == 2:
+            data[f'Date {col}'] = [f'20{rng.randint(10, 24)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}' for _ in range(rows)]
+        else:
+            data[f'Status {col}'] = [rng.choice(['Submitted', 'Lost', 'Won', None]) for _ in range(rows)]
+    return pd.DataFrame(data)
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--cols', type=int, default=8)
+    parser.add_argument('--term', default='Construction of Internal Roads at Airport Showroom Zone at Duqm')
+    parser.add_argument('--threshold', type=float, default=0.8)
+    parser.add_argument('--skip-legacy', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_file = f'{tmp}/sheet.csv'
+        synthetic_sheet(args.rows, args.cols).to_csv(csv_file, index=False)
+        csv_meta = [{"csv_file_path": csv_file, "sheet_name": "sheet"}]
+
+        _, store_build = timed(build_cell_store, csv_table_sources(csv_meta), f'{tmp}/cells')
+        _, index_build = timed(build_search_index, csv_table_sources(csv_meta), f'{tmp}/search_index.db')
+        columnar, columnar_time = timed(cell_store_lookup, f'{tmp}/cells', args.term, args.threshold)
+        indexed, index_time = timed(search_index_lookup, f'{tmp}/search_index.db', args.term, args.threshold)
+
+        print(f'{args.rows} rows x {args.cols} columns, threshold {args.threshold}, {len(columnar)} matching cells')
+        print(f'build    cell store {store_build:8.2f}s   search index {index_build:8.2f}s')
+        if not args.skip_legacy:
+            legacy, legacy_time = timed(legacy_find_approx_text, [csv_file], args.term, args.threshold)
+            without_table = lambda results: [{key: value for key, value in result.items() if key != 'table_name'} for result in results]
+            assert legacy == without_table(columnar) == without_table(indexed), 'results differ from the legacy scan'
+            print(f'legacy   {legacy_time:8.3f}s  {args.rows / legacy_time:12.0f} rows/s')
+        print(f'columnar {columnar_time:8.3f}s  {args.rows / columnar_time:12.0f} rows/s')
+        print(f'index    {index_time:8.3f}s  {args.rows / index_time:12.0f} rows/s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import argparse
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.ingest import open_workbook
+from lib.sheet_profile import profile_workbook, sheets_by_class, pdf_page_mapping
+from lib.sheet_text import serialize_small_sheets
+from lib.image_prep import prepare_images
+from lib.utils import encode_image, page_number_mapping, rasterize_pdf_pages
+from lib.soffice_pool import convert_workbook_pdf, pdf_sheet_order
+from lib.table_render import render_table_image
+
+# usage: python benchmarks/bench_small_sheet_modes.py --sheets 6
+#        python benchmarks/bench_small_sheet_modes.py --workbook book.xlsx --live "What is the total for North?"
+# Without --workbook a synthetic workbook is used and its images are drawn with the Pillow table renderer
+# as a stand-in for the soffice + ImageMagick pages. --live sends the question to small_sheet_query_agent
+# once per mode and reports the measured latency and prompt tokens.
+
+def synthetic_workbook(path, sheets, seed=0):
+    rng = random.Random(seed)
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for sheet_idx in range(sheets):
+        sheet = workbook.create_sheet(f'Summary {sheet_idx}')
+        sheet.append(['Region', 'Budget', None, 'Owner'])
+        sheet.merge_cells('B1:C1')
+        sheet.append([None, 'Planned', 'Actual', None])
+        for region in ['North', 'South', 'East', 'West', 'Central', 'Interior', 'Coast', 'Islands'][:rng.randint(4, 8)]:
+            sheet.append([region, round(rng.random() * 1e5, 2), round(rng.random() * 1e5, 2), rng.choice(['Ali', 'Maya', 'Chen', 'Sara'])])
+    workbook.save(path)
+    return path
+
+def render_pages(workbook, file_path, sheet_names, profiles, tmp):
+    # real pages when soffice and ImageMagick are around, the Pillow renderer otherwise
+    page_mapping = page_number_mapping(workbook.sheetnames)
+    pdf_pages = pdf_page_mapping(profiles)
+    sheet_pages = {name: pdf_pages.get(name) for name in sheet_names}
+    pdf_file, _, method = convert_workbook_pdf(file_path, tmp, sheet_pages)
+    if pdf_file is not None:
+        os.makedirs('temp_files/bench', exist_ok=True)
+        return rasterize_pdf_pages(pdf_file, pdf_sheet_order(sheet_pages, method), page_mapping, 'bench'), 'soffice'
+    images = {}
+    for name in sheet_names:
+        rows = [['' if value is None else value for value in row] for row in workbook[name].iter_rows(values_only=True)]
+        images[name] = render_table_image(rows[0], rows[1:], f'{tmp}/{len(images)}.png')
+    return images, 'pillow'
+
+def image_parts(manifest):
+    return [{"type": "image_url", "image_url": {"url": f"data:{img['mime']};base64,{encode_image(img['path'])}", "detail": img['detail']}} for img in manifest]
+
+def live_run(question, images, texts):
+    from lib.util_agent import small_sheet_query_agent
+    from lib.usage_tracker import usage_rollup
+    cuuid = f'bench-{time.time_ns()}'
+    start = time.perf_counter()
+    answer = small_sheet_query_agent(question, images, cuuid, texts)
+    return answer, time.perf_counter() - start, usage_rollup(cuuid)['input_tokens']
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sheets', type=int, default=6)
+    parser.add_argument('--workbook', default='')
+    parser.add_argument('--live', default='', help='question to ask small_sheet_query_agent in both modes')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = args.workbook or synthetic_workbook(f'{tmp}/small_sheets.xlsx', args.sheets)
+        workbook = open_workbook(file_path)
+        profiles = profile_workbook(workbook)
+        sheet_names = [sheet.title for sheet in sheets_by_class(workbook, profiles, 'small')]
+        print(f'{len(sheet_names)} small sheets')
+
+        start = time.perf_counter()
+        with open(serialize_small_sheets(workbook, file_path, sheet_names, f'{tmp}/text.json'), 'r') as f:
+            texts = json.load(f)
+        text_build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pages, renderer = render_pages(workbook, file_path, sheet_names, profiles, tmp)
+        with open(prepare_images(pages, f'{tmp}/images'), 'r') as f:
+            manifest = json.load(f)
+        image_build = time.perf_counter() - start
+
+        # same four characters per token estimate the llm gateway uses
+        text_tokens = sum(len(f"Sheet: {entry['sheet_name']}\n{entry['text']}") // 4 for entry in texts)
+        image_tokens = sum(img['tokens'] for img in manifest)
+        print(f'index    text {text_build:8.3f}s   images ({renderer}) {image_build:8.3f}s')
+        print(f'payload  text {sum(entry["chars"] for entry in texts):8d} chars  images {sum(img["bytes"] for img in manifest):8d} bytes')
+        print(f'tokens   text {text_tokens:8d} (estimated)  images {image_tokens:8d} (vision pricing)')
+        print(f'needs image in hybrid mode: {[entry["sheet_name"] for entry in texts if entry["needs_image"]]}')
+
+        if args.live:
+            for mode, images, sheet_texts in [('image', image_parts(manifest), []), ('text', [], texts)]:
+                answer, elapsed, input_tokens = live_run(args.live, images, sheet_texts)
+                print(f'live     {mode:5s} {elapsed:8.2f}s  {input_tokens:8d} input tokens  answer: {answer}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import os
+import json
+import hashlib
+import threading
+from lib.utils import page_number_mapping, sample_table_rows, get_img_from_db
+from lib.table_render import markdown_table, SAMPLE_RENDER_MODE
+
+# per-table sample artifacts are made the first time /ask routes to a table rather than at upload.
+# Each one is kept in memory and persisted under temp_files/<cuuid>/artifacts/, keyed by cuuid and table
+ARTIFACT_WARMUP = os.getenv('ARTIFACT_WARMUP', '0') == '1'
+
+artifacts_lock = threading.Lock()
+artifact_cache = {}
+artifact_locks = {}
+
+def artifact_path(cuuid, table_name):
+    # table names are sheet names and may hold characters that do not belong in a file name
+    digest = hashlib.sha1(table_name.encode('utf-8')).hexdigest()
+    return f'temp_files/{cuuid}/artifacts/{digest}.json'
+
+def build_table_artifacts(metadata, table_name):
+    cuuid = metadata['cuuid']
+    db_path = metadata['big_sheets']['sqllite_db_path']
+    page_mapping = page_number_mapping(list(metadata.get('sheet_profiles') or [csv_meta['sheet_name'] for csv_meta in metadata['big_sheets']['csv_file_meta']]))
+    sample = sample_table_rows(db_path, table_name)
+    artifacts = {
+        "table_name": table_name,
+        "sample_markdown": markdown_table(*sample),
+        "sample_image": ""
+    }
+    if SAMPLE_RENDER_MODE != 'text':
+        artifacts['sample_image'] = get_img_from_db(db_path, table_name, page_mapping[table_name], page_mapping, cuuid, sample) or ""
+    return artifacts
+
+def table_artifacts(metadata, table_name):
+    key = (metadata['cuuid'], table_name)
+    with artifacts_lock:
+        if key in artifact_cache:
+            return artifact_cache[key]
+        key_lock = artifact_locks.setdefault(key, threading.Lock())
+
+    # one build per table even when several requests route to it at once
+    with key_lock:
+        with artifacts_lock:
+            if key in artifact_cache:
+                return artifact_cache[key]
+        file_path = artifact_path(*key)
+        artifacts = None
+        if os.path.exists(file_path):
+            with open(file_path, 'r') as f:
+                artifacts = json.load(f)
+            if artifacts['sample_image'] and not os.path.exists(artifacts['sample_image']):
+                artifacts = None
+        if artifacts is None:
+            artifacts = build_table_artifacts(metadata, table_name)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'w') as f:
+                json.dump(artifacts, f)
+        with artifacts_lock:
+            artifact_cache[key] = artifacts
+            artifact_locks.pop(key, None)
+        return artifacts
+
+def warm_artifacts(metadata):
+    # fills in every table's artifacts in the background once indexing is done
+    def run():
+        for csv_meta in metadata['big_sheets']['csv_file_meta']:
+            try:
+                table_artifacts(metadata, csv_meta['sheet_name'])
+            except Exception as e:
+                print(f"Error: warming artifacts for {csv_meta['sheet_name']} failed: {e}")
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
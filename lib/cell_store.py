@@ -0,0 +1,157 @@
+import os
+import json
+from itertools import islice
+from collections import Counter
+import numpy as np
+from lib.search_index import normalize_cell, min_substring_length, best_substring_match
+
+# characters are folded into 64 buckets, a bucket missing from a cell rules out every character in it
+CHARMASK_BITS = 64
+# rows held in memory at a time while a sheet is written out
+CELL_STORE_BATCH_ROWS = int(os.getenv('CELL_STORE_BATCH_ROWS', 20000))
+
+def char_mask(text):
+    mask = 0
+    for char in set(text):
+        mask |= 1 << (ord(char) % CHARMASK_BITS)
+    return mask
+
+def stats_arrays(cells, shape):
+    return (
+        np.array([len(cell) for cell in cells], dtype=np.int32).reshape(shape),
+        np.array([cell.count(' ') + 1 if cell else 0 for cell in cells], dtype=np.int32).reshape(shape),
+        np.array([char_mask(cell) for cell in cells], dtype=np.uint64).reshape(shape),
+    )
+
+def spill_sheet(source, spill_prefix, batch_rows):
+    # first pass: rows arrive row by row, each batch is normalized and spilled to disk column by column.
+    # Returns [(batch row count, [(spill offset, byte size) per column])]
+    batches = []
+    rows = iter(source['rows'])
+    with open(f'{spill_prefix}_data.bin', 'wb') as data_spill, open(f'{spill_prefix}_stats.npy', 'wb') as stats_spill:
+        while True:
+            batch = list(islice(rows, batch_rows))
+            if not batch:
+                break
+            columns = [[] for _ in source['columns']]
+            for _, values in batch:
+                for col_pos, cell_value in enumerate(values):
+                    columns[col_pos].append(normalize_cell(cell_value))
+            column_spans = []
+            for column in columns:
+                data = ''.join(column).encode('utf-32-le')
+                column_spans.append((data_spill.tell(), len(data)))
+                data_spill.write(data)
+            np.save(stats_spill, np.array([int(row) for row, _ in batch], dtype=np.int64))
+            for array in stats_arrays([cell for column in columns for cell in column], (len(columns), len(batch))):
+                np.save(stats_spill, array)
+            batches.append((len(batch), column_spans))
+    return batches
+
+def build_cell_store(table_sources, store_dir, batch_rows=CELL_STORE_BATCH_ROWS):
+    # per sheet: normalized cell text as utf-32 code points plus per-cell length, token count and
+    # character mask arrays, laid out column by column so a column is one contiguous slice.
+    # Sheets are spilled in row batches and assembled into the column layout straight on disk,
+    # so memory stays at one batch whatever the sheet size
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = []
+    for sheet_idx, source in enumerate(table_sources):
+        prefix = f'{store_dir}/{sheet_idx}'
+        batches = spill_sheet(source, f'{prefix}_spill', batch_rows)
+        shape = (len(source['columns']), sum(count for count, _ in batches))
+        total_chars = sum(size for _, spans in batches for _, size in spans) // 4
+        arrays = {
+            "rows": (np.int64, (shape[1],)),
+            "lengths": (np.int32, shape),
+            "tokens": (np.int32, shape),
+            "charmask": (np.uint64, shape),
+            "offsets": (np.int64, (shape[0] * shape[1] + 1,)),
+            "data": (np.uint32, (total_chars,)),
+        }
+        stores = {}
+        for name, (dtype, array_shape) in arrays.items():
+            # an empty array cannot be memory mapped, it is saved from memory at the end instead
+            if np.prod(array_shape) == 0:
+                stores[name] = np.zeros(array_shape, dtype=dtype)
+            else:
+                stores[name] = np.lib.format.open_memmap(f'{prefix}_{name}.npy', mode='w+', dtype=dtype, shape=array_shape)
+
+        row_start = 0
+        with open(f'{prefix}_spill_stats.npy', 'rb') as stats_spill:
+            for count, _ in batches:
+                stores['rows'][row_start:row_start + count] = np.load(stats_spill)
+                for name in ['lengths', 'tokens', 'charmask']:
+                    stores[name][:, row_start:row_start + count] = np.load(stats_spill)
+                row_start += count
+        stores['offsets'][0] = 0
+        np.cumsum(stores['lengths'].reshape(-1), dtype=np.int64, out=stores['offsets'][1:])
+
+        position = 0
+        with open(f'{prefix}_spill_data.bin', 'rb') as data_spill:
+            for col_pos in range(shape[0]):
+                for _, spans in batches:
+                    offset, size = spans[col_pos]
+                    data_spill.seek(offset)
+                    chunk = np.frombuffer(data_spill.read(size), dtype=np.uint32)
+                    stores['data'][position:position + len(chunk)] = chunk
+                    position += len(chunk)
+
+        for name, array in stores.items():
+            if isinstance(array, np.memmap):
+                array.flush()
+            else:
+                np.save(f'{prefix}_{name}.npy', array)
+        del stores
+        for spill in [f'{prefix}_spill_data.bin', f'{prefix}_spill_stats.npy']:
+            os.remove(spill)
+        manifest.append({
+            "filename": source['filename'],
+            "table_name": source['table_name'],
+            "columns": source['columns'],
+        })
+    with open(f'{store_dir}/manifest.json', 'w') as f:
+        json.dump(manifest, f)
+    return store_dir
+
+def candidate_mask(lengths, tokens, charmask, search_text, threshold):
+    # cheap vectorized bounds, a cell failing any of them cannot reach the threshold:
+    # the best substring is at most as long as the cell, and it can match at most the
+    # search characters whose bucket appears in the cell
+    search_len = len(search_text)
+    min_len = min_substring_length(search_len, threshold)
+    keep = (tokens > 0) & (lengths >= min_len)
+    if threshold <= 0 or not keep.any():
+        return keep
+    overlap = np.zeros(lengths.shape, dtype=np.int32)
+    for bucket, count in Counter(ord(char) % CHARMASK_BITS for char in search_text).items():
+        overlap += count * ((charmask >> np.uint64(bucket)) & np.uint64(1)).astype(np.int32)
+    return keep & (2 * overlap >= threshold * (search_len + min_len) - 1e-9)
+
+def cell_store_lookup(store_dir, search_text, threshold=0.8):
+    with open(f'{store_dir}/manifest.json', 'r') as f:
+        manifest = json.load(f)
+
+    final_results = []
+    scored = {}
+    for sheet_idx, sheet in enumerate(manifest):
+        arrays = {name: np.load(f'{store_dir}/{sheet_idx}_{name}.npy', mmap_mode='r') for name in ['data', 'offsets', 'rows', 'lengths', 'tokens', 'charmask']}
+        n_rows = arrays['rows'].shape[0]
+        if n_rows == 0:
+            continue
+        keep = candidate_mask(arrays['lengths'], arrays['tokens'], arrays['charmask'], search_text, threshold)
+        for col_pos, row_pos in zip(*np.nonzero(keep)):
+            cell_idx = col_pos * n_rows + row_pos
+            cell_value = arrays['data'][arrays['offsets'][cell_idx]:arrays['offsets'][cell_idx + 1]].tobytes().decode('utf-32-le')
+            if cell_value not in scored:
+                scored[cell_value] = best_substring_match(search_text, cell_value, threshold)
+            match = scored[cell_value]
+            if match is not None:
+                final_results.append({
+                    'filename': sheet['filename'],
+                    'table_name': sheet['table_name'],
+                    'row': int(arrays['rows'][row_pos]),
+                    'column': sheet['columns'][col_pos],
+                    'substring': match[0],
+                    'similarity': match[1]
+                })
+    return final_results
@@ -0,0 +1,107 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+from lib.utils import encode_image
+from lib.sql_engine import sql_pool
+from lib.ingest import describe_tables
+from lib.sheet_text import sheets_as_text
+
+# everything /ask needs per workbook, kept across questions: parsed metadata (schema catalog included),
+# prebuilt small sheet message parts and the pool of read-only connections. Entries are evicted least
+# recently used first, by count and by estimated size, and rebuilt when a file they came from changes
+CONTEXT_CACHE_SIZE = int(os.getenv('CONTEXT_CACHE_SIZE', 16))
+CONTEXT_CACHE_MAX_MB = float(os.getenv('CONTEXT_CACHE_MAX_MB', 256))
+context_cache = OrderedDict()
+context_cache_lock = threading.Lock()
+
+def metadata_path(cuuid):
+    return f'temp_files/{cuuid}/{cuuid}_metadata.json'
+
+def file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except (OSError, TypeError):
+        return None
+
+def source_mtimes(cuuid, metadata):
+    paths = [metadata_path(cuuid), metadata['small_sheets'].get('image_manifest'), metadata['small_sheets'].get('text_manifest')]
+    return tuple(file_mtime(path) for path in paths)
+
+def read_json(path, default):
+    if not path or not os.path.exists(path):
+        return default
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def build_context(cuuid):
+    with open(metadata_path(cuuid), 'r') as f:
+        metadata = json.load(f)
+    context = {
+        "cuuid": cuuid,
+        "metadata": metadata,
+        "mtimes": source_mtimes(cuuid, metadata),
+        "image_parts": [],
+        "sheet_texts": [],
+        "sql_pool": None,
+        "schema_catalog": {},
+        "size": 0
+    }
+    if 'cuuid' not in metadata:
+        # still indexing, nothing else is ready yet
+        return context
+    image_manifest = read_json(metadata['small_sheets'].get('image_manifest'), [])
+    for img in image_manifest:
+        context['image_parts'].append({
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{img['mime']};base64,{encode_image(img['path'])}",
+                "detail": img['detail']
+            }
+        })
+    for img in read_json(metadata['small_sheets'].get('encoded_images_json'), []):
+        # workbooks indexed before the image manifest kept ready-made data urls
+        context['image_parts'].append({"type": "image_url", "image_url": {"url": img['image_encoding']}})
+    context['sheet_texts'] = sheets_as_text(read_json(metadata['small_sheets'].get('text_manifest'), []), {img['sheet_name'] for img in image_manifest})
+    if len(metadata['big_sheets']['sqllite_db_path']) > 0:
+        context['sql_pool'] = sql_pool(metadata['big_sheets']['sqllite_db_path'])
+        context['schema_catalog'] = metadata['big_sheets'].get('schema_catalog')
+        if context['schema_catalog'] is None:
+            # indexed before the schema catalog existed, describe the tables from the database instead
+            context['schema_catalog'] = describe_tables(metadata['big_sheets']['sqllite_db_path'], [csv_meta['sheet_name'] for csv_meta in metadata['big_sheets']['csv_file_meta']])
+    context['size'] = (
+        len(json.dumps(metadata))
+        + sum(len(part['image_url']['url']) for part in context['image_parts'])
+        + sum(len(entry['text']) for entry in context['sheet_texts'])
+    )
+    return context
+
+def is_fresh(context):
+    return context['mtimes'] == source_mtimes(context['cuuid'], context['metadata'])
+
+def evict():
+    # callers hold context_cache_lock. Evicted pools are not closed here, a request that is still
+    # using one keeps it alive and its connections close once the last reference goes away
+    max_bytes = CONTEXT_CACHE_MAX_MB * 1024 * 1024
+    while len(context_cache) > CONTEXT_CACHE_SIZE or (len(context_cache) > 1 and sum(context['size'] for context in context_cache.values()) > max_bytes):
+        context_cache.popitem(last=False)
+
+def workbook_context(cuuid):
+    # None when the workbook has no metadata on disk
+    if not os.path.exists(metadata_path(cuuid)):
+        return None
+    with context_cache_lock:
+        context = context_cache.get(cuuid)
+        if context is not None:
+            context_cache.move_to_end(cuuid)
+    if context is not None and is_fresh(context):
+        return context
+
+    context = build_context(cuuid)
+    if 'cuuid' not in context['metadata'] or CONTEXT_CACHE_SIZE <= 0:
+        return context
+    with context_cache_lock:
+        context_cache[cuuid] = context
+        context_cache.move_to_end(cuuid)
+        evict()
+    return context
@@ -0,0 +1,87 @@
+import os
+import re
+import json
+import datetime
+from lib.log_writer import file_logger
+
+# simple result shapes (one value, one row, a short list of values, nothing found) are worded locally
+# and streamed straight away; anything richer still goes through response_humanizer_agent
+FAST_ANSWER = os.getenv('FAST_ANSWER', 'true').lower() in ('1', 'true', 'yes')
+FAST_ANSWER_MAX_VALUES = int(os.getenv('FAST_ANSWER_MAX_VALUES', 10))
+PLAIN_COLUMN = re.compile(r'^[A-Za-z][A-Za-z0-9_ ]*$')
+# columns whose numbers are labels rather than quantities: "order_id", "Zip Code", "fiscal year", "customerId"
+IDENTIFIER_COLUMN = re.compile(r'(?:^|[^a-z])(?:id|key|code|no|num|number|year|zip|phone|ref|reference)s?$', re.IGNORECASE)
+CAMEL_IDENTIFIER_COLUMN = re.compile(r'[a-z0-9](?:Id|ID|Key|Code|No|Num|Number|Year|Zip|Phone|Ref)s?$')
+
+NOT_FOUND_TEXT = "I couldn't find an answer to that in the workbook. Please try again, or reformulate the question a little (for example name the sheet or column you mean)."
+TIMEOUT_TEXT = "Looking that up took too long, so the search was stopped. Please try again with a narrower question (for example a single sheet, column or time period)."
+ERROR_TEXT = "Something went wrong while looking that up in the workbook, so there is no answer yet. Please try again, or reformulate the question a little."
+
+def column_label(name):
+    # "total_bid" -> "Total bid"; expressions such as count(*) get no label
+    if not name or not PLAIN_COLUMN.match(name):
+        return None
+    label = ' '.join(name.replace('_', ' ').split())
+    return label[:1].upper() + label[1:]
+
+def is_identifier_column(name):
+    return bool(name) and bool(IDENTIFIER_COLUMN.search(name) or CAMEL_IDENTIFIER_COLUMN.search(name))
+
+def format_value(value, column=None):
+    if value is None or value == '':
+        return 'empty'
+    if isinstance(value, bool):
+        return 'yes' if value else 'no'
+    if isinstance(value, int):
+        # larger counts get separators; ids, codes and years are only recognisable by their column name
+        if is_identifier_column(column):
+            return str(value)
+        return f'{value:,}' if abs(value) >= 10000 else str(value)
+    if isinstance(value, float):
+        if value.is_integer():
+            return format_value(int(value), column)
+        return f'{value:,.2f}' if abs(value) >= 1 else f'{value:.4g}'
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+def fast_answer_text(results):
+    # results as compact_results returns them; None when the shape needs the humanizer
+    if not FAST_ANSWER or len(results) == 0:
+        return None
+    if all(not isinstance(entry['result'], list) for entry in results):
+        # only failures (a summary dict is not a failure, it goes to the humanizer). A failed query says
+        # nothing about whether the data is there, so it is never worded as "not found"
+        if not all(isinstance(entry['result'], str) for entry in results):
+            return None
+        if any(entry['result'].startswith('Query timed out') for entry in results):
+            return TIMEOUT_TEXT
+        return ERROR_TEXT
+    if len(results) > 1:
+        return None
+    entry = results[0]
+    rows = entry['result']
+    columns = entry.get('columns') or []
+    if len(rows) == 0:
+        return NOT_FOUND_TEXT
+    if entry.get('truncated'):
+        return None
+    width = max(len(row) for row in rows)
+    if len(rows) == 1 and width == 1:
+        column = columns[0] if columns else None
+        label = column_label(column)
+        return f'{label}: {format_value(rows[0][0], column)}' if label else f'The answer is {format_value(rows[0][0], column)}.'
+    if len(rows) == 1 and width <= FAST_ANSWER_MAX_VALUES and len(columns) == width:
+        return '\n'.join(f'- {column_label(column) or column}: {format_value(value, column)}' for column, value in zip(columns, rows[0]))
+    if width == 1 and len(rows) <= FAST_ANSWER_MAX_VALUES:
+        column = columns[0] if columns else None
+        label = column_label(column)
+        heading = f'{label} ({len(rows)} values):' if label else f'Found {len(rows)} values:'
+        return '\n'.join([heading] + [f'- {format_value(row[0], column)}' for row in rows])
+    return None
+
+def stream_fast_answer(text, cuuid):
+    # same response_stream protocol as response_humanizer_agent, without the llm round trip
+    file_logger("fast_answer", text, cuuid)
+    yield json.dumps({'success': text, 'action': "response_stream"}).encode() + b"\n"
+    yield json.dumps({'success': True, 'action': "response_stream_complete"}).encode() + b"\n"
@@ -0,0 +1,102 @@
+import os
+import io
+import math
+import json
+from PIL import Image, ImageChops
+
+# small sheet images are fitted to a vision token budget before they are stored. Token counts follow the
+# OpenAI image pricing: 85 tokens at low detail; at high detail the image is fitted into 2048x2048, its
+# short side brought down to 768, and every 512px tile costs 170 tokens on top of the base 85
+IMAGE_TOKEN_BUDGET = int(os.getenv('IMAGE_TOKEN_BUDGET', 765))
+IMAGE_DETAIL = os.getenv('IMAGE_DETAIL', 'auto')
+# sheets taller than this many widths that do not fit the budget as they are get cut into stacked tiles,
+# shrinking them whole would make the text unreadable
+IMAGE_MAX_ASPECT = float(os.getenv('IMAGE_MAX_ASPECT', 3))
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', 85))
+LOW_DETAIL_TOKENS = 85
+TILE_TOKENS = 170
+TILE_SIZE = 512
+
+def vision_tokens(width, height, detail='high'):
+    if detail == 'low':
+        return LOW_DETAIL_TOKENS
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return LOW_DETAIL_TOKENS + TILE_TOKENS * math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+
+def trim_image(image):
+    # crop away the uniform border, using the top left pixel as the background colour
+    image = image.convert('RGB')
+    background = Image.new('RGB', image.size, image.getpixel((0, 0)))
+    bbox = ImageChops.difference(image, background).getbbox()
+    return image.crop(bbox) if bbox else image
+
+def split_tall_image(image, budget=IMAGE_TOKEN_BUDGET, max_aspect=IMAGE_MAX_ASPECT):
+    width, height = image.size
+    if height <= width * max_aspect or vision_tokens(width, height) <= budget:
+        return [image]
+    tile_height = int(width * max_aspect)
+    return [image.crop((0, top, width, min(top + tile_height, height))) for top in range(0, height, tile_height)]
+
+def fit_to_budget(image, budget=IMAGE_TOKEN_BUDGET, detail=IMAGE_DETAIL):
+    # returns (image, detail): the largest size whose high detail cost fits the budget, or a
+    # 512px low detail image when not even a single tile fits or low detail was asked for
+    if detail == 'low' or (detail == 'auto' and budget < LOW_DETAIL_TOKENS + TILE_TOKENS):
+        image = image.copy()
+        image.thumbnail((TILE_SIZE, TILE_SIZE), Image.LANCZOS)
+        return image, 'low'
+    width, height = image.size
+    scale = 1.0
+    while vision_tokens(width * scale, height * scale) > budget and min(width, height) * scale > TILE_SIZE / 4:
+        scale *= 0.9
+    if scale < 1.0:
+        image = image.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+    return image, 'high'
+
+def encode_smallest(image):
+    # sheets are mostly flat colour and text, where png wins; photos and gradients fall back to jpeg
+    png = io.BytesIO()
+    if image.getcolors(256) is not None:
+        # a palette is lossless when the image has at most 256 colours
+        image.convert('P', palette=Image.ADAPTIVE, colors=256).save(png, format='PNG', optimize=True)
+    else:
+        image.save(png, format='PNG', optimize=True)
+    jpeg = io.BytesIO()
+    image.save(jpeg, format='JPEG', quality=IMAGE_JPEG_QUALITY, optimize=True)
+    if png.tell() <= jpeg.tell() * 1.5:
+        return png.getvalue(), 'image/png', 'png'
+    return jpeg.getvalue(), 'image/jpeg', 'jpg'
+
+def prepare_images(images, output_dir):
+    # images maps sheet name to its rendered page, missing renders are skipped.
+    # Writes the prepared files and manifest.json to output_dir and returns the manifest path
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = []
+    for sheet_idx, (sheet_name, image_path) in enumerate(images.items()):
+        if image_path is None or not os.path.exists(image_path):
+            continue
+        with Image.open(image_path) as source:
+            tiles = split_tall_image(trim_image(source))
+        for tile_idx, tile in enumerate(tiles):
+            tile, detail = fit_to_budget(tile)
+            data, mime, extension = encode_smallest(tile)
+            file_path = f'{output_dir}/{sheet_idx}_{tile_idx}.{extension}'
+            with open(file_path, 'wb') as f:
+                f.write(data)
+            manifest.append({
+                "sheet_name": sheet_name,
+                "tile": tile_idx,
+                "path": file_path,
+                "mime": mime,
+                "detail": detail,
+                "width": tile.width,
+                "height": tile.height,
+                "bytes": len(data),
+                "tokens": vision_tokens(tile.width, tile.height, detail)
+            })
+    manifest_path = f'{output_dir}/manifest.json'
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest_path
@@ -0,0 +1,324 @@
+import os
+import re
+import time
+import csv
+import sqlite3
+import datetime
+from collections import Counter
+from openpyxl import load_workbook
+from lib.utils import quote_identifier
+from lib.search_index import build_search_index
+from lib.cell_store import build_cell_store
+
+# rows are streamed from openpyxl's read-only reader straight into SQLite, so a sheet is never
+# held in memory as a whole; only one batch of rows is buffered at a time
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 5000))
+STAGING_TABLE = '__ingest_staging'
+
+# text columns are indexed when they look like keys: mostly distinct, reasonably short values
+INDEX_MIN_DISTINCT_RATIO = float(os.getenv('INDEX_MIN_DISTINCT_RATIO', 0.5))
+INDEX_MIN_DISTINCT = int(os.getenv('INDEX_MIN_DISTINCT', 20))
+INDEX_MAX_AVG_LENGTH = int(os.getenv('INDEX_MAX_AVG_LENGTH', 120))
+
+# the build is throwaway until it finishes, so durability is traded for load speed
+INGEST_CACHE_MB = int(os.getenv('INGEST_CACHE_MB', 256))
+INGEST_PAGE_SIZE = int(os.getenv('INGEST_PAGE_SIZE', 8192))
+INGEST_JOURNAL_MODE = os.getenv('INGEST_JOURNAL_MODE', 'OFF')
+
+# example values kept per column in the schema catalog, long text is cut short
+CATALOG_EXAMPLES = int(os.getenv('CATALOG_EXAMPLES', 3))
+CATALOG_EXAMPLE_CHARS = 60
+
+# numbers typed in as text, optionally with thousands separators: 1234, -1,234.50
+NUMERIC_TEXT = re.compile(r'^\s*[+-]?(?:\d{1,3}(?:,\d{3})+|\d+)(\.\d+)?\s*$')
+
+def open_workbook(file_path):
+    return load_workbook(file_path, read_only=True)
+
+def sqlite_value(value):
+    # dates become ISO 8601 text, whitespace-only strings count as empty cells
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, str):
+        return value if value.strip() else None
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, datetime.datetime):
+        if value.time() == datetime.time(0):
+            return value.date().isoformat()
+        return value.isoformat(sep=' ')
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+def value_kind(value):
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, datetime.datetime):
+        return 'date' if value.time() == datetime.time(0) else 'datetime'
+    if isinstance(value, datetime.date):
+        return 'date'
+    if isinstance(value, str):
+        match = NUMERIC_TEXT.match(value)
+        if match:
+            return 'float_text' if match.group(1) else 'int_text'
+    return 'text'
+
+def infer_column_type(kinds):
+    # (inferred type, sqlite affinity) from the kinds of values seen in a column
+    seen = set(kinds)
+    if seen <= {'bool'}:
+        return 'boolean', 'INTEGER'
+    if seen <= {'bool', 'int', 'int_text'}:
+        return 'integer', 'INTEGER'
+    if seen <= {'int', 'float', 'int_text', 'float_text'}:
+        return 'real', 'REAL'
+    if seen <= {'date'}:
+        return 'date', 'TEXT'
+    if seen <= {'date', 'datetime'}:
+        return 'datetime', 'TEXT'
+    return 'text', 'TEXT'
+
+def header_names(header_row):
+    # same labels pandas gave the csv round trip: missing headers become 'Unnamed: n', duplicates get .1, .2, ...
+    names = []
+    seen = {}
+    for idx, value in enumerate(header_row):
+        name = f'Unnamed: {idx}' if value is None or str(value).strip() == '' else str(value)
+        if name in seen:
+            seen[name] += 1
+            candidate = f'{name}.{seen[name]}'
+            while candidate in seen:
+                seen[name] += 1
+                candidate = f'{name}.{seen[name]}'
+            name = candidate
+        seen.setdefault(name, 0)
+        names.append(name)
+    return names
+
+def stream_sheet_to_sqlite(sheet, conn, table_name, batch_size=INGEST_BATCH_SIZE, header_row=1, used_range=None):
+    # the profiled header row is the header and anything above it is skipped, fully empty rows are
+    # skipped as they stream by. used_range (from the profile) bounds the read to the cells that hold
+    # values, whatever the sheet declares. Rows land in an
+    # untyped staging table while the kinds of values per column are counted, then the typed table
+    # is built from it without the columns that never received a value
+    bounds = {}
+    if used_range and used_range['last_row']:
+        bounds = {"max_row": used_range['last_row'], "max_col": used_range['last_column']}
+    rows = sheet.iter_rows(min_row=max(header_row, 1), values_only=True, **bounds)
+    header = next(rows, None)
+    columns = header_names(header or ())
+    kinds = [Counter() for _ in columns]
+    staging = quote_identifier(STAGING_TABLE)
+
+    conn.execute(f'DROP TABLE IF EXISTS {staging}')
+    conn.execute(f'CREATE TABLE {staging} ({", ".join(quote_identifier(column) for column in columns) or "_empty"})')
+
+    def insert(batch):
+        placeholders = ', '.join('?' * len(columns))
+        conn.executemany(f'INSERT INTO {staging} ({", ".join(quote_identifier(column) for column in columns)}) VALUES ({placeholders})', batch)
+
+    row_count = 0
+    batch = []
+    for row in rows:
+        values = [sqlite_value(value) for value in row]
+        if all(value is None for value in values):
+            continue
+        if len(values) > len(columns):
+            # rows wider than the header, only happens on sheets without a stored dimension
+            if batch:
+                insert(batch)
+                batch = []
+            for column in header_names(list(header or ()) + [None] * (len(values) - len(header or ())))[len(columns):]:
+                conn.execute(f'ALTER TABLE {staging} ADD COLUMN {quote_identifier(column)}')
+                columns.append(column)
+                kinds.append(Counter())
+        values += [None] * (len(columns) - len(values))
+        for idx, value in enumerate(values):
+            if value is not None:
+                kinds[idx][value_kind(row[idx])] += 1
+        batch.append(values)
+        row_count += 1
+        if len(batch) >= batch_size:
+            insert(batch)
+            batch = []
+    if batch:
+        insert(batch)
+
+    schema = build_typed_table(conn, table_name, columns, kinds)
+    schema['rows'] = row_count
+    for column in schema['columns']:
+        column['null_ratio'] = round(1 - column['non_null'] / row_count, 4) if row_count else 0.0
+    return schema
+
+def build_typed_table(conn, table_name, columns, kinds):
+    table = quote_identifier(table_name)
+    staging = quote_identifier(STAGING_TABLE)
+    column_schema = []
+    definitions = []
+    expressions = []
+    for column, column_kinds in zip(columns, kinds):
+        if not column_kinds:
+            continue
+        inferred_type, affinity = infer_column_type(column_kinds)
+        name = quote_identifier(column)
+        definitions.append(f'{name} {affinity}')
+        if affinity in ('INTEGER', 'REAL') and (column_kinds['int_text'] or column_kinds['float_text']):
+            # numbers stored as text lose their thousands separators and become real numbers
+            expressions.append(f"CASE WHEN typeof({name}) = 'text' THEN CAST(REPLACE(TRIM({name}), ',', '') AS {affinity}) ELSE {name} END")
+        else:
+            expressions.append(name)
+        column_schema.append({"name": column, "type": inferred_type, "affinity": affinity, "indexed": False})
+
+    conn.execute(f'DROP TABLE IF EXISTS {table}')
+    if not column_schema:
+        conn.execute(f'ALTER TABLE {staging} RENAME TO {table}')
+        return {"table_name": table_name, "columns": column_schema}
+    conn.execute(f'CREATE TABLE {table} ({", ".join(definitions)})')
+    conn.execute(f'INSERT INTO {table} SELECT {", ".join(expressions)} FROM {staging}')
+    conn.execute(f'DROP TABLE {staging}')
+    create_key_indexes(conn, table_name, column_schema)
+    add_column_examples(conn, table_name, column_schema)
+    return {"table_name": table_name, "columns": column_schema}
+
+def create_key_indexes(conn, table_name, column_schema):
+    table = quote_identifier(table_name)
+    stats = []
+    for column in column_schema:
+        name = quote_identifier(column['name'])
+        stats.append(f'COUNT({name}), COUNT(DISTINCT {name}), AVG(LENGTH({name}))')
+    values = conn.execute(f'SELECT {", ".join(stats)} FROM {table}').fetchone()
+    for idx, column in enumerate(column_schema):
+        non_null, distinct, avg_length = values[idx * 3:idx * 3 + 3]
+        column['non_null'] = non_null
+        column['distinct'] = distinct
+        if column['affinity'] != 'TEXT' or not non_null:
+            continue
+        if distinct >= INDEX_MIN_DISTINCT and distinct / non_null >= INDEX_MIN_DISTINCT_RATIO and (avg_length or 0) <= INDEX_MAX_AVG_LENGTH:
+            index_name = quote_identifier(f'idx_{table_name}_{column["name"]}')
+            conn.execute(f'CREATE INDEX {index_name} ON {table} ({quote_identifier(column["name"])})')
+            column['indexed'] = True
+
+def bulk_load_connect(db_path):
+    # page size only applies to a fresh file, so any previous build is removed first
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute(f'PRAGMA page_size = {INGEST_PAGE_SIZE}')
+    conn.execute(f'PRAGMA journal_mode = {INGEST_JOURNAL_MODE}')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute(f'PRAGMA cache_size = -{INGEST_CACHE_MB * 1024}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    conn.execute('PRAGMA locking_mode = EXCLUSIVE')
+    return conn
+
+def bulk_load_sheets(conn, sheets, profiles, batch_size=INGEST_BATCH_SIZE):
+    # every sheet in one transaction, yields each table's schema along with the load rate. A failed load
+    # deletes the database file, callers rebuild it from bulk_load_connect
+    conn.execute('BEGIN')
+    try:
+        for sheet in sheets:
+            start = time.perf_counter()
+            profile = profiles[sheet.title]
+            schema = stream_sheet_to_sqlite(sheet, conn, sheet.title, batch_size, profile['header_row'], profile['used_range'])
+            elapsed = time.perf_counter() - start
+            schema['load_seconds'] = round(elapsed, 3)
+            schema['rows_per_second'] = round(schema['rows'] / elapsed) if elapsed > 0 else schema['rows']
+            yield schema
+        conn.execute('COMMIT')
+    except BaseException:
+        # with journal_mode OFF (the default) there is no rollback journal, so ROLLBACK leaves the file in an
+        # undefined state. A failed load never rolls back: the connection is closed and the file deleted
+        db_path = conn.execute('PRAGMA database_list').fetchone()[2]
+        conn.close()
+        for path in [db_path, db_path + '-journal', db_path + '-wal', db_path + '-shm']:
+            if path and os.path.exists(path):
+                os.remove(path)
+        raise
+
+def finalize_database(conn):
+    # planner statistics, compaction and the query-time settings; the file is only read from here on
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA locking_mode = NORMAL')
+    conn.execute('PRAGMA journal_mode = DELETE')
+    conn.execute('VACUUM')
+    conn.execute('PRAGMA synchronous = NORMAL')
+
+def open_readonly(db_path):
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, check_same_thread=False)
+    conn.execute('PRAGMA query_only = ON')
+    return conn
+
+def describe_tables(db_path, table_names):
+    # schema catalog entries read back with PRAGMA table_info, for workbooks indexed before the catalog existed
+    conn = open_readonly(db_path)
+    catalog = {}
+    try:
+        for table_name in table_names:
+            columns = conn.execute(f'PRAGMA table_info({quote_identifier(table_name)})').fetchall()
+            if not columns:
+                continue
+            catalog[table_name] = {
+                "table_name": table_name,
+                "rows": conn.execute(f'SELECT COUNT(*) FROM {quote_identifier(table_name)}').fetchone()[0],
+                "columns": [{"name": column[1], "type": (column[2] or 'text').lower(), "affinity": (column[2] or 'TEXT').upper()} for column in columns]
+            }
+    finally:
+        conn.close()
+    return catalog
+
+def add_column_examples(conn, table_name, column_schema, limit=CATALOG_EXAMPLES):
+    # the first few distinct values of each column, enough for the query writer to see their format
+    table = quote_identifier(table_name)
+    for column in column_schema:
+        name = quote_identifier(column['name'])
+        examples = conn.execute(f'SELECT DISTINCT {name} FROM {table} WHERE {name} IS NOT NULL LIMIT {int(limit)}').fetchall()
+        column['examples'] = [value[:CATALOG_EXAMPLE_CHARS] if isinstance(value, str) else value for (value,) in examples]
+
+def export_table_csv(conn, table_name, csv_path, batch_size=INGEST_BATCH_SIZE):
+    cursor = conn.execute(f'SELECT * FROM {quote_identifier(table_name)}')
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([column[0] for column in cursor.description])
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            writer.writerows(rows)
+    return csv_path
+
+def sqlite_table_sources(db_path, csv_file_meta, batch_size=INGEST_BATCH_SIZE):
+    # cell strings for the fuzzy search structures, read back from the loaded tables
+    conn = sqlite3.connect(db_path)
+    try:
+        for csv_meta in csv_file_meta:
+            cursor = conn.execute(f'SELECT * FROM {quote_identifier(csv_meta["sheet_name"])}')
+            columns = [column[0] for column in cursor.description]
+            yield {
+                "filename": csv_meta['csv_file_path'] or db_path,
+                "table_name": csv_meta['sheet_name'],
+                "columns": columns,
+                "rows": enumerate_table_rows(cursor, batch_size)
+            }
+    finally:
+        conn.close()
+
+def enumerate_table_rows(cursor, batch_size):
+    row_idx = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield row_idx, ['' if value is None else str(value) for value in row]
+            row_idx += 1
+
+def build_fuzzy_search(db_path, csv_file_meta, output_dir, backend='index'):
+    # module level so the ingestion pipeline can run it in a worker process; returns the metadata key and path
+    if backend == 'columnar':
+        return 'cell_store_dir', build_cell_store(sqlite_table_sources(db_path, csv_file_meta), f'{output_dir}/cells')
+    return 'search_index_path', build_search_index(sqlite_table_sources(db_path, csv_file_meta), f'{output_dir}/search_index.db')
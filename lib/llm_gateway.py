@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import heapq
+import random
+import itertools
+import threading
+from collections import deque
+import httpx
+import openai
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# every agent call goes through chat_completion: one pooled client, request/token rate limits, a
+# priority queue (lower first, ties in arrival order) and jittered retries on transient failures.
+# Every call the app makes today answers a user, so they all run at PRIORITY_INTERACTIVE; work that
+# can wait passes a larger number
+PRIORITY_INTERACTIVE = 0
+
+LLM_RPM_LIMIT = float(os.getenv('LLM_RPM_LIMIT', 0))
+LLM_TPM_LIMIT = float(os.getenv('LLM_TPM_LIMIT', 0))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 8))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 4))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 120))
+LLM_RETRY_BASE_DELAY = 0.5
+LLM_RETRY_MAX_DELAY = 20
+LLM_DEFAULT_OUTPUT_TOKENS = 512
+IMAGE_TOKEN_ESTIMATE = 765
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+llm_client = openai.OpenAI(
+    api_key=os.getenv('OPENAI_API_KEY'),
+    base_url=os.getenv('OPENAI_BASE_URL') or None,
+    max_retries=0,
+    http_client=httpx.Client(
+        limits=httpx.Limits(max_connections=LLM_MAX_CONCURRENCY * 2, max_keepalive_connections=LLM_MAX_CONCURRENCY),
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=10)
+    )
+)
+
+scheduler_lock = threading.Condition()
+waiting_queue = []
+waiting_counter = itertools.count()
+in_flight = 0
+buckets = {
+    "requests": {"limit": LLM_RPM_LIMIT, "level": LLM_RPM_LIMIT, "updated": time.monotonic()},
+    "tokens": {"limit": LLM_TPM_LIMIT, "level": LLM_TPM_LIMIT, "updated": time.monotonic()},
+}
+
+stats_lock = threading.Lock()
+stats = {
+    "calls": 0,
+    "errors": 0,
+    "retries": 0,
+    "rate_limited": 0,
+    "prompt_tokens": 0,
+    "completion_tokens": 0,
+    "total_tokens": 0,
+    "latency_seconds_total": 0.0,
+}
+recent_latencies = deque(maxlen=1000)
+
+def estimate_tokens(messages, max_tokens=None):
+    # rough pre-call estimate for the token bucket, corrected once the real usage is known
+    chars = 0
+    images = 0
+    for message in messages:
+        content = message.get('content', '')
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content:
+            if part.get('type') == 'image_url':
+                images += 1
+            else:
+                chars += len(json.dumps(part))
+    return chars // 4 + images * IMAGE_TOKEN_ESTIMATE + (max_tokens or LLM_DEFAULT_OUTPUT_TOKENS)
+
+def refill(bucket, now):
+    if bucket['limit'] > 0:
+        bucket['level'] = min(bucket['limit'], bucket['level'] + (now - bucket['updated']) * bucket['limit'] / 60)
+    bucket['updated'] = now
+
+def seconds_until_available(bucket, amount):
+    if bucket['limit'] <= 0:
+        return 0
+    # a single call larger than the whole bucket only waits for a full bucket
+    amount = min(amount, bucket['limit'])
+    if bucket['level'] >= amount:
+        return 0
+    return (amount - bucket['level']) * 60 / bucket['limit']
+
+def acquire_slot(priority, tokens):
+    global in_flight
+    entry = (priority, next(waiting_counter))
+    with scheduler_lock:
+        heapq.heappush(waiting_queue, entry)
+        try:
+            while True:
+                now = time.monotonic()
+                for bucket in buckets.values():
+                    refill(bucket, now)
+                delay = max(seconds_until_available(buckets['requests'], 1), seconds_until_available(buckets['tokens'], tokens))
+                if waiting_queue[0] == entry and in_flight < LLM_MAX_CONCURRENCY and delay == 0:
+                    heapq.heappop(waiting_queue)
+                    buckets['requests']['level'] -= 1
+                    buckets['tokens']['level'] -= tokens
+                    in_flight += 1
+                    scheduler_lock.notify_all()
+                    return
+                scheduler_lock.wait(timeout=delay if delay > 0 else 0.5)
+        except BaseException:
+            if entry in waiting_queue:
+                waiting_queue.remove(entry)
+                heapq.heapify(waiting_queue)
+                scheduler_lock.notify_all()
+            raise
+
+def release_slot(estimated_tokens, usage=None):
+    global in_flight
+    with scheduler_lock:
+        in_flight -= 1
+        if usage is not None:
+            # charge the bucket with what the call really used
+            buckets['tokens']['level'] -= usage_value(usage, 'total_tokens') - estimated_tokens
+        scheduler_lock.notify_all()
+
+def usage_value(usage, key):
+    if isinstance(usage, dict):
+        return usage.get(key) or 0
+    return getattr(usage, key, 0) or 0
+
+def record_call(latency, usage=None, error=False):
+    with stats_lock:
+        stats['calls'] += 1
+        stats['errors'] += 1 if error else 0
+        stats['latency_seconds_total'] += latency
+        recent_latencies.append(latency)
+        if usage is not None:
+            for key in ['prompt_tokens', 'completion_tokens', 'total_tokens']:
+                stats[key] += usage_value(usage, key)
+
+def retry_delay(error, attempt):
+    retry_after = None
+    response = getattr(error, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), LLM_RETRY_MAX_DELAY) + random.uniform(0, LLM_RETRY_BASE_DELAY)
+        except ValueError:
+            pass
+    # full jitter exponential backoff
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+
+def create_with_retries(request):
+    attempt = 0
+    while True:
+        try:
+            return request()
+        except RETRYABLE_ERRORS as e:
+            if attempt >= LLM_MAX_RETRIES:
+                raise
+            with stats_lock:
+                stats['retries'] += 1
+                stats['rate_limited'] += 1 if isinstance(e, openai.RateLimitError) else 0
+            time.sleep(retry_delay(e, attempt))
+            attempt += 1
+
+def chat_completion(messages, priority=PRIORITY_INTERACTIVE, **kwargs):
+    kwargs.setdefault('model', os.getenv('OPENAI_GEN_MODEL'))
+    estimated_tokens = estimate_tokens(messages, kwargs.get('max_tokens'))
+    acquire_slot(priority, estimated_tokens)
+    start = time.monotonic()
+    if kwargs.get('stream'):
+        try:
+            stream = create_with_retries(lambda: llm_client.chat.completions.create(messages=messages, **kwargs))
+        except BaseException:
+            release_slot(estimated_tokens)
+            record_call(time.monotonic() - start, error=True)
+            raise
+        return stream_with_slot(stream, estimated_tokens, start)
+
+    response = None
+    try:
+        response = create_with_retries(lambda: llm_client.chat.completions.create(messages=messages, **kwargs))
+        return response
+    finally:
+        usage = response.usage if response is not None else None
+        release_slot(estimated_tokens, usage)
+        record_call(time.monotonic() - start, usage, error=response is None)
+
+def stream_with_slot(stream, estimated_tokens, start):
+    # the concurrency slot is held until the stream is drained or closed
+    usage = None
+    completed = False
+    try:
+        for chunk in stream:
+            chunk_usage = getattr(chunk, 'usage', None)
+            if chunk_usage is not None:
+                usage = chunk_usage
+            yield chunk
+        completed = True
+    finally:
+        release_slot(estimated_tokens, usage)
+        record_call(time.monotonic() - start, usage, error=not completed)
+
+def gateway_stats():
+    with stats_lock:
+        latencies = sorted(recent_latencies)
+        snapshot = dict(stats)
+    with scheduler_lock:
+        snapshot['in_flight'] = in_flight
+        snapshot['waiting'] = len(waiting_queue)
+    snapshot['latency_p50'] = latencies[len(latencies) // 2] if latencies else None
+    snapshot['latency_p95'] = latencies[int(len(latencies) * 0.95)] if latencies else None
+    snapshot['latency_avg'] = snapshot['latency_seconds_total'] / snapshot['calls'] if snapshot['calls'] else None
+    return snapshot
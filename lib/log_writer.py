@@ -0,0 +1,117 @@
+import os
+import json
+import queue
+import atexit
+import hashlib
+import threading
+import pandas as pd
+
+# payload strings longer than this (image data urls mostly) are stored once under log_blobs/ and referenced by hash
+LOG_BLOB_MIN_CHARS = int(os.getenv('LOG_BLOB_MIN_CHARS', 4096))
+LOG_BATCH_SIZE = 256
+
+log_queue = queue.Queue()
+writer_thread = None
+writer_start_lock = threading.Lock()
+cuuid_locks = {}
+cuuid_locks_lock = threading.Lock()
+
+def log_file_path(cuuid):
+    return f"temp_files/{cuuid}/{cuuid}_logs.jsonl"
+
+def cuuid_lock(cuuid):
+    with cuuid_locks_lock:
+        if cuuid not in cuuid_locks:
+            cuuid_locks[cuuid] = threading.Lock()
+        return cuuid_locks[cuuid]
+
+def externalize_blobs(data, cuuid):
+    if isinstance(data, str):
+        if len(data) < LOG_BLOB_MIN_CHARS:
+            return data
+        encoded = data.encode('utf-8')
+        digest = hashlib.sha256(encoded).hexdigest()
+        blob_path = f"temp_files/{cuuid}/log_blobs/{digest}.txt"
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            with open(f"{blob_path}.tmp", "wb") as f:
+                f.write(encoded)
+            os.replace(f"{blob_path}.tmp", blob_path)
+        return {"$blob": digest, "chars": len(data)}
+    if isinstance(data, dict):
+        return {key: externalize_blobs(value, cuuid) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [externalize_blobs(value, cuuid) for value in data]
+    return data
+
+def write_batch(batch):
+    lines_by_cuuid = {}
+    for cuuid, entry in batch:
+        try:
+            entry['data'] = externalize_blobs(entry['data'], cuuid)
+            line = json.dumps(entry, default=str)
+        except Exception as e:
+            line = json.dumps({"timestamp": entry['timestamp'], "process": entry['process'], "data": f"unloggable payload: {e!r}"})
+        lines_by_cuuid.setdefault(cuuid, []).append(line + "\n")
+    for cuuid, lines in lines_by_cuuid.items():
+        if not os.path.isdir(f"temp_files/{cuuid}"):
+            continue
+        with cuuid_lock(cuuid):
+            with open(log_file_path(cuuid), "a") as file:
+                file.write("".join(lines))
+
+def writer_loop():
+    while True:
+        item = log_queue.get()
+        batch = []
+        flushes = []
+        while True:
+            if isinstance(item, threading.Event):
+                flushes.append(item)
+            else:
+                batch.append(item)
+            if len(batch) >= LOG_BATCH_SIZE:
+                break
+            try:
+                item = log_queue.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            write_batch(batch)
+        except Exception as e:
+            print("Error writing logs:", e)
+        for event in flushes:
+            event.set()
+
+def ensure_writer():
+    global writer_thread
+    with writer_start_lock:
+        if writer_thread is None or not writer_thread.is_alive():
+            writer_thread = threading.Thread(target=writer_loop, name="log-writer", daemon=True)
+            writer_thread.start()
+
+def file_logger(process_name, response_data, cuuid):
+    if not isinstance(response_data, (str, dict, list)):
+        response_data = response_data.model_dump_json()
+
+    ensure_writer()
+    log_queue.put((cuuid, {
+        "timestamp": pd.Timestamp.now().isoformat(),
+        "process": process_name,
+        "data": response_data
+    }))
+
+def flush_logs(timeout=10):
+    ensure_writer()
+    event = threading.Event()
+    log_queue.put(event)
+    return event.wait(timeout)
+
+def reset_logs(cuuid):
+    flush_logs()
+    with cuuid_lock(cuuid):
+        for file_path in [log_file_path(cuuid), f"temp_files/{cuuid}/{cuuid}_logs.json"]:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+atexit.register(flush_logs)
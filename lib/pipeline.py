@@ -0,0 +1,120 @@
+import os
+import time
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+# independent ingestion stages run side by side. Stages that shell out or wait on io run on threads,
+# pure python cpu work (index builds) is sent to worker processes so it does not hold the GIL
+PIPELINE_THREAD_WORKERS = int(os.getenv('PIPELINE_THREAD_WORKERS', 4))
+PIPELINE_PROCESS_WORKERS = int(os.getenv('PIPELINE_PROCESS_WORKERS', 2))
+
+# worker processes are spawned rather than forked, the web server forking itself mid-request would copy
+# locks held by its other threads. Spawning means a fresh interpreter importing everything again, so the
+# pool is created once, on the first upload that needs it, and shared by every later run
+process_pool = None
+process_pool_lock = threading.Lock()
+
+def shared_process_pool(workers=PIPELINE_PROCESS_WORKERS):
+    global process_pool
+    with process_pool_lock:
+        if process_pool is None:
+            process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return process_pool
+
+def discard_process_pool(pool):
+    # a worker died (BrokenProcessPool), the next run starts a fresh pool
+    global process_pool
+    with process_pool_lock:
+        if process_pool is pool:
+            process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_process_pool():
+    global process_pool
+    with process_pool_lock:
+        pool, process_pool = process_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+atexit.register(shutdown_process_pool)
+
+def pipeline_stage(name, func, args=(), deps=(), pool='thread', on_done=None):
+    # func(*args) runs once every stage in deps has finished; on_done(result) runs afterwards in the
+    # scheduling thread, which is the only place stage results are folded back into shared state.
+    # process stages need a module level func and picklable args
+    return {"name": name, "func": func, "args": args, "deps": tuple(deps), "pool": pool, "on_done": on_done}
+
+def timed_call(func, args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def resolve_args(args):
+    # args given as a callable are built when the stage is submitted, after its dependencies have finished
+    return args() if callable(args) else args
+
+def run_pipeline(stages, thread_workers=PIPELINE_THREAD_WORKERS, process_workers=PIPELINE_PROCESS_WORKERS):
+    # yields {"stage", "status", "elapsed", ...} as stages finish. After a failed stage nothing new is
+    # started: every stage still waiting, dependent or not, is reported as skipped, and the error is
+    # raised once the stages already in flight have settled
+    by_name = {stage['name']: stage for stage in stages}
+    for stage in stages:
+        missing = [dep for dep in stage['deps'] if dep not in by_name]
+        if missing:
+            raise ValueError(f"Stage {stage['name']} depends on unknown stages: {missing}")
+
+    done = set()
+    running = {}
+    waiting = list(stages)
+    error = None
+    pipeline_start = time.perf_counter()
+    threads = ThreadPoolExecutor(max_workers=thread_workers)
+    processes = threads
+    if any(stage['pool'] == 'process' for stage in stages):
+        processes = shared_process_pool(process_workers)
+    try:
+        while waiting or running:
+            if error is None:
+                for stage in [stage for stage in waiting if all(dep in done for dep in stage['deps'])]:
+                    waiting.remove(stage)
+                    executor = processes if stage['pool'] == 'process' else threads
+                    try:
+                        future = executor.submit(timed_call, stage['func'], resolve_args(stage['args']))
+                    except BrokenProcessPool:
+                        discard_process_pool(executor)
+                        raise
+                    running[future] = stage
+            else:
+                for stage in waiting:
+                    yield {"stage": stage['name'], "status": "skipped", "elapsed": 0.0}
+                waiting = []
+            if not running:
+                if waiting:
+                    raise ValueError(f"Stages cannot be scheduled: {[stage['name'] for stage in waiting]}")
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    result, elapsed = future.result()
+                    if stage['on_done'] is not None:
+                        stage['on_done'](result)
+                except Exception as e:
+                    if isinstance(e, BrokenProcessPool):
+                        discard_process_pool(processes)
+                    error = error or e
+                    yield {"stage": stage['name'], "status": "failed", "elapsed": 0.0, "error": str(e)}
+                    continue
+                done.add(stage['name'])
+                yield {"stage": stage['name'], "status": "done", "elapsed": round(elapsed, 3)}
+    finally:
+        # the shared process pool stays up for later runs
+        threads.shutdown(wait=True)
+
+    if error is not None:
+        raise error
+    yield {"stage": "pipeline", "status": "done", "elapsed": round(time.perf_counter() - pipeline_start, 3)}
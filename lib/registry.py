@@ -0,0 +1,107 @@
+import os
+import sys
+import json
+import glob
+import sqlite3
+import hashlib
+from datetime import datetime
+
+# the registry lives next to the workbook directories it describes, temp_files/<cuuid>/
+REGISTRY_ROOT = 'temp_files'
+REGISTRY_DB_PATH = os.path.join(REGISTRY_ROOT, 'registry.db')
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+def file_checksum(file_path, chunk_size=CHECKSUM_CHUNK_SIZE):
+    # md5 in fixed-size chunks so large workbooks never sit fully in memory
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+def registry_connect(db_path=REGISTRY_DB_PATH):
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS workbooks (
+            checksum TEXT PRIMARY KEY,
+            cuuid TEXT NOT NULL,
+            status TEXT NOT NULL,
+            file_path TEXT,
+            updated_at TEXT
+        )
+    ''')
+    return conn
+
+def registry_record(checksum, cuuid, status, file_path=None, db_path=REGISTRY_DB_PATH):
+    # concurrent uploads of one file race on the same checksum: a run may always update its own row, and
+    # may take over another run's row unless that one is indexed, but a failure never overwrites another run
+    conn = registry_connect(db_path)
+    try:
+        with conn:
+            conn.execute('''
+                INSERT INTO workbooks (checksum, cuuid, status, file_path, updated_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (checksum) DO UPDATE SET
+                    cuuid = excluded.cuuid, status = excluded.status, file_path = excluded.file_path, updated_at = excluded.updated_at
+                WHERE workbooks.cuuid = excluded.cuuid OR (workbooks.status != 'indexed' AND excluded.status != 'failed')
+            ''', (checksum, cuuid, status, file_path, datetime.now().isoformat()))
+    finally:
+        conn.close()
+
+def registry_lookup(checksum, db_path=REGISTRY_DB_PATH):
+    if not os.path.exists(db_path):
+        return None
+    conn = registry_connect(db_path)
+    try:
+        row = conn.execute('SELECT cuuid, status, file_path FROM workbooks WHERE checksum = ?', (checksum,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {"checksum": checksum, "cuuid": row[0], "status": row[1], "file_path": row[2]}
+
+def lookup_indexed_workbook(checksum, db_path=REGISTRY_DB_PATH):
+    # only hand back a cuuid whose indexing finished and whose files are still on disk
+    entry = registry_lookup(checksum, db_path)
+    if entry is None or entry['status'] != 'indexed':
+        return None
+    root = os.path.dirname(db_path)
+    if not os.path.exists(f"{root}/{entry['cuuid']}/{entry['cuuid']}_metadata.json"):
+        return None
+    return entry['cuuid']
+
+def rebuild_registry(root=REGISTRY_ROOT):
+    conn = registry_connect(os.path.join(root, 'registry.db'))
+    count = 0
+    try:
+        with conn:
+            conn.execute('DELETE FROM workbooks')
+            for file_path in glob.glob(f'{root}/*/*.xlsx'):
+                cuuid = file_path.split('/')[-2]
+                status = 'indexing'
+                metadata_file_path = f'{root}/{cuuid}/{cuuid}_metadata.json'
+                if os.path.exists(metadata_file_path):
+                    with open(metadata_file_path, 'r') as f:
+                        if 'cuuid' in json.load(f):
+                            status = 'indexed'
+                checksum = file_checksum(file_path)
+                # prefer an indexed copy when the same workbook was uploaded more than once
+                existing = conn.execute('SELECT status FROM workbooks WHERE checksum = ?', (checksum,)).fetchone()
+                if existing is not None and existing[0] == 'indexed':
+                    continue
+                conn.execute(
+                    'INSERT OR REPLACE INTO workbooks (checksum, cuuid, status, file_path, updated_at) VALUES (?, ?, ?, ?, ?)',
+                    (checksum, cuuid, status, file_path, datetime.now().isoformat())
+                )
+                count += 1
+    finally:
+        conn.close()
+    return count
+
+if __name__ == '__main__':
+    # usage: python -m lib.registry rebuild [temp_files_root]
+    if len(sys.argv) < 2 or sys.argv[1] != 'rebuild':
+        print('usage: python -m lib.registry rebuild [temp_files_root]')
+        sys.exit(1)
+    root = sys.argv[2] if len(sys.argv) > 2 else REGISTRY_ROOT
+    print(f'Registered {rebuild_registry(root)} workbooks')
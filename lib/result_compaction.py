@@ -0,0 +1,105 @@
+import os
+import json
+from lib.ingest import value_kind
+
+# query results are compacted before they reach response_humanizer_agent: duplicates and failures next to
+# successful answers are dropped, large row sets become a summary (row count, head and tail rows, per
+# column aggregates) and the whole payload is shrunk until it fits RESULT_TOKEN_BUDGET
+RESULT_TOKEN_BUDGET = int(os.getenv('RESULT_TOKEN_BUDGET', 2000))
+RESULT_FULL_ROWS = int(os.getenv('RESULT_FULL_ROWS', 20))
+RESULT_SAMPLE_ROWS = int(os.getenv('RESULT_SAMPLE_ROWS', 5))
+RESULT_TOP_VALUES = 3
+RESULT_CELL_CHARS = 200
+
+def payload_tokens(payload):
+    # same four characters per token estimate the llm gateway uses
+    return len(json.dumps(payload, default=str)) // 4
+
+def clip_cell(value, max_chars=RESULT_CELL_CHARS):
+    if isinstance(value, str) and len(value) > max_chars:
+        return value[:max_chars] + '...'
+    return value
+
+def clip_rows(rows, max_chars=RESULT_CELL_CHARS):
+    return [[clip_cell(value, max_chars) for value in row] for row in rows]
+
+def column_aggregates(columns, rows):
+    aggregates = []
+    for idx, name in enumerate(columns):
+        values = [row[idx] for row in rows if idx < len(row) and row[idx] is not None]
+        numbers = [value for value in values if value_kind(value) in ('int', 'float')]
+        aggregate = {"column": name, "non_null": len(values)}
+        if values and len(numbers) == len(values):
+            aggregate.update({"min": min(numbers), "max": max(numbers), "sum": round(sum(numbers), 6), "mean": round(sum(numbers) / len(numbers), 6)})
+        else:
+            counts = {}
+            for value in values:
+                counts[str(value)] = counts.get(str(value), 0) + 1
+            aggregate['distinct'] = len(counts)
+            aggregate['top'] = [clip_cell(value) for value, _ in sorted(counts.items(), key=lambda item: -item[1])[:RESULT_TOP_VALUES]]
+        aggregates.append(aggregate)
+    return aggregates
+
+def summarize_entry(entry, sample_rows):
+    # rows over the full row limit turn into head, tail and aggregates; the aggregates only see fetched rows
+    rows = entry['result']
+    summary = {key: value for key, value in entry.items() if key not in ('result', 'elapsed')}
+    summary['result'] = {
+        "summary": True,
+        "row_count": len(rows),
+        "more_rows_not_fetched": entry.get('truncated', False),
+        "head": clip_rows(rows[:sample_rows]),
+        "tail": clip_rows(rows[max(sample_rows, len(rows) - sample_rows):]) if sample_rows else [],
+        "aggregates": column_aggregates(entry.get('columns', []), rows)
+    }
+    return summary
+
+def is_failed(entry):
+    return not isinstance(entry['result'], list)
+
+def dedupe_results(results):
+    seen = set()
+    unique = []
+    for entry in results:
+        query = ' '.join(str(entry.get('query') or '').lower().split())
+        key = (query, json.dumps(entry['result'], default=str)) if query else (entry['table_name'], json.dumps(entry['result'], default=str))
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(entry)
+    return unique
+
+def compact_entry(entry, full_rows, sample_rows):
+    if is_failed(entry):
+        return {key: value for key, value in entry.items() if key != 'elapsed'}
+    if len(entry['result']) > full_rows:
+        return summarize_entry(entry, sample_rows)
+    compact = {key: value for key, value in entry.items() if key != 'elapsed'}
+    compact['result'] = clip_rows(entry['result'])
+    return compact
+
+def compact_results(results, budget=RESULT_TOKEN_BUDGET):
+    # returns the list handed to the humanizer; entries keep the {"table_name", "query", "result", ...} shape
+    results = dedupe_results(results)
+    answered = [entry for entry in results if not is_failed(entry)]
+    if answered:
+        # failures only matter when nothing answered the question
+        results = answered
+
+    # tighten step by step: fewer full rows, smaller samples, no aggregates, then drop trailing entries
+    full_rows, sample_rows = RESULT_FULL_ROWS, RESULT_SAMPLE_ROWS
+    compacted = [compact_entry(entry, full_rows, sample_rows) for entry in results]
+    while payload_tokens(compacted) > budget and (full_rows > 0 or sample_rows > 0):
+        full_rows, sample_rows = full_rows // 2, sample_rows // 2
+        compacted = [compact_entry(entry, full_rows, sample_rows) for entry in results]
+    if payload_tokens(compacted) > budget:
+        for entry in compacted:
+            if isinstance(entry['result'], dict):
+                entry['result']['aggregates'] = [{"column": aggregate['column'], "non_null": aggregate['non_null']} for aggregate in entry['result']['aggregates']]
+    dropped = 0
+    while len(compacted) > 1 and payload_tokens(compacted) > budget:
+        compacted.pop()
+        dropped += 1
+    if dropped:
+        compacted.append({"table_name": None, "query": None, "result": f'{dropped} more results were left out to fit the prompt'})
+    return compacted
@@ -0,0 +1,181 @@
+import os
+import math
+import sqlite3
+from collections import Counter, OrderedDict
+from difflib import SequenceMatcher
+import pandas as pd
+
+# q-gram size of the inverted index. The count filter below is only guaranteed
+# to keep every match while t * (2q - 1) / 2 > q - 1, which for trigrams needs a
+# threshold above 0.8, so bigrams are indexed to stay exact at the default 0.8.
+QGRAM_SIZE = 2
+INSERT_BATCH_SIZE = 10000
+# distinct cell strings whose value ids are kept in memory, older ones are looked up in the vals table
+VALUE_CACHE_SIZE = max(1, int(os.getenv('SEARCH_INDEX_VALUE_CACHE', 100000)))
+
+def normalize_cell(cell_value):
+    # find_approx_text only ever compares ' '.join(words[i:j]) slices of this string
+    return ' '.join(cell_value.split())
+
+def qgram_counts(text, q=QGRAM_SIZE):
+    return Counter(text[i:i+q] for i in range(len(text) - q + 1))
+
+def min_substring_length(search_len, threshold):
+    # ratio <= 2 * min(la, ls) / (la + ls), so shorter substrings can never reach the threshold
+    if threshold <= 0 or threshold >= 2:
+        return 0
+    return max(0, math.ceil(search_len * threshold / (2 - threshold) - 1e-9))
+
+def min_shared_qgrams(search_len, threshold, q=QGRAM_SIZE):
+    # M matched characters in k matching blocks share at least M - k(q - 1) q-grams,
+    # k <= T - 2M + 1 and M >= tT / 2, which bounds the shared q-grams from below
+    coefficient = threshold * (2 * q - 1) / 2 - (q - 1)
+    if coefficient <= 0:
+        return 0
+    total_len = search_len + min_substring_length(search_len, threshold)
+    return max(0, math.ceil(coefficient * total_len - (q - 1) - 1e-6))
+
+def best_substring_match(search_text, cell_value, threshold):
+    # same scan as the original find_approx_text loop, minus the SequenceMatcher calls
+    # that the length bound already rules out
+    words = cell_value.split()
+    search_len = len(search_text)
+    best = None
+    for i in range(len(words)):
+        for j in range(i+1, len(words)+1):
+            substring = ' '.join(words[i:j])
+            substring_len = len(substring)
+            if search_len + substring_len == 0 or 2.0 * min(search_len, substring_len) / (search_len + substring_len) < threshold:
+                if substring_len > search_len:
+                    break
+                continue
+            matcher = SequenceMatcher(None, search_text, substring)
+            # quick_ratio is an upper bound of ratio and much cheaper to compute
+            if matcher.quick_ratio() < threshold:
+                continue
+            similarity = matcher.ratio()
+            if similarity >= threshold and (best is None or similarity > best[1]):
+                best = (substring, similarity)
+    return best
+
+def csv_table_sources(csv_file_meta):
+    # cells are stringified exactly like DataFrame.iterrows() + str() did in find_approx_text
+    for csv_meta in csv_file_meta:
+        df = pd.read_csv(csv_meta['csv_file_path'])
+        yield {
+            "filename": csv_meta['csv_file_path'],
+            "table_name": csv_meta['sheet_name'],
+            "columns": [str(col) for col in df.columns],
+            "rows": zip(df.index, (map(str, values) for values in df.values))
+        }
+
+def build_search_index(table_sources, index_path, q=QGRAM_SIZE):
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    conn = sqlite3.connect(index_path)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.executescript('''
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE files (id INTEGER PRIMARY KEY, filename TEXT, table_name TEXT);
+        CREATE TABLE cols (file_id INTEGER, col_pos INTEGER, name TEXT, PRIMARY KEY (file_id, col_pos));
+        CREATE TABLE vals (id INTEGER PRIMARY KEY, text TEXT UNIQUE, norm_len INTEGER);
+        CREATE TABLE cells (file_id INTEGER, row INTEGER, col_pos INTEGER, value_id INTEGER);
+        CREATE TABLE postings (gram TEXT, value_id INTEGER, cnt INTEGER, PRIMARY KEY (gram, value_id)) WITHOUT ROWID;
+    ''')
+    # recently seen values only; the UNIQUE index on vals.text answers the rest, so memory stays bounded
+    value_ids = OrderedDict()
+    value_count = 0
+    cells = []
+    postings = []
+    with conn:
+        conn.execute('INSERT INTO meta VALUES (?, ?)', ('qgram_size', str(q)))
+        for file_id, source in enumerate(table_sources):
+            conn.execute('INSERT INTO files VALUES (?, ?, ?)', (file_id, source['filename'], source['table_name']))
+            conn.executemany('INSERT INTO cols VALUES (?, ?, ?)', [(file_id, pos, name) for pos, name in enumerate(source['columns'])])
+            for row, values in source['rows']:
+                for col_pos, cell_value in enumerate(values):
+                    value_id = value_ids.get(cell_value)
+                    if value_id is None:
+                        normalized = normalize_cell(cell_value)
+                        # cells without words never produce a substring to compare
+                        if not normalized:
+                            continue
+                        row_id = conn.execute('SELECT id FROM vals WHERE text = ?', (cell_value,)).fetchone()
+                        if row_id is not None:
+                            value_id = row_id[0]
+                        else:
+                            value_id = value_count
+                            value_count += 1
+                            conn.execute('INSERT INTO vals VALUES (?, ?, ?)', (value_id, cell_value, len(normalized)))
+                            postings.extend((gram, value_id, cnt) for gram, cnt in qgram_counts(normalized, q).items())
+                        if len(value_ids) >= VALUE_CACHE_SIZE:
+                            value_ids.popitem(last=False)
+                    else:
+                        value_ids.move_to_end(cell_value)
+                    value_ids[cell_value] = value_id
+                    cells.append((file_id, int(row), col_pos, value_id))
+                    if len(cells) >= INSERT_BATCH_SIZE:
+                        conn.executemany('INSERT INTO cells VALUES (?, ?, ?, ?)', cells)
+                        cells = []
+                    if len(postings) >= INSERT_BATCH_SIZE:
+                        conn.executemany('INSERT INTO postings VALUES (?, ?, ?)', postings)
+                        postings = []
+        conn.executemany('INSERT INTO cells VALUES (?, ?, ?, ?)', cells)
+        conn.executemany('INSERT INTO postings VALUES (?, ?, ?)', postings)
+        conn.execute('CREATE INDEX cells_value ON cells (value_id)')
+    conn.close()
+    return index_path
+
+def search_index_lookup(index_path, search_text, threshold=0.8):
+    conn = sqlite3.connect(index_path)
+    try:
+        q = int(conn.execute("SELECT value FROM meta WHERE key = 'qgram_size'").fetchone()[0])
+        min_len = min_substring_length(len(search_text), threshold)
+        min_shared = min_shared_qgrams(len(search_text), threshold, q)
+        if min_shared > 0:
+            # candidate values share enough q-grams with the search text to possibly match
+            conn.execute('CREATE TEMP TABLE search_grams (gram TEXT PRIMARY KEY, cnt INTEGER)')
+            conn.executemany('INSERT INTO search_grams VALUES (?, ?)', qgram_counts(search_text, q).items())
+            candidates = conn.execute('''
+                SELECT v.id, v.text FROM (
+                    SELECT p.value_id, SUM(MIN(p.cnt, s.cnt)) AS shared
+                    FROM search_grams s JOIN postings p ON p.gram = s.gram
+                    GROUP BY p.value_id
+                ) c JOIN vals v ON v.id = c.value_id
+                WHERE c.shared >= ? AND v.norm_len >= ?
+            ''', (min_shared, min_len)).fetchall()
+        else:
+            candidates = conn.execute('SELECT id, text FROM vals WHERE norm_len >= ?', (min_len,)).fetchall()
+
+        matches = {}
+        for value_id, cell_value in candidates:
+            match = best_substring_match(search_text, cell_value, threshold)
+            if match is not None:
+                matches[value_id] = match
+
+        final_results = []
+        if matches:
+            conn.execute('CREATE TEMP TABLE matched (value_id INTEGER PRIMARY KEY)')
+            conn.executemany('INSERT INTO matched VALUES (?)', [(value_id,) for value_id in matches])
+            rows = conn.execute('''
+                SELECT f.filename, f.table_name, c.row, l.name, c.value_id
+                FROM cells c
+                JOIN matched m ON m.value_id = c.value_id
+                JOIN files f ON f.id = c.file_id
+                JOIN cols l ON l.file_id = c.file_id AND l.col_pos = c.col_pos
+                ORDER BY c.file_id, c.col_pos, c.row
+            ''').fetchall()
+            for filename, table_name, row, col, value_id in rows:
+                substring, similarity = matches[value_id]
+                final_results.append({
+                    'filename': filename,
+                    'table_name': table_name,
+                    'row': row,
+                    'column': col,
+                    'substring': substring,
+                    'similarity': similarity
+                })
+    finally:
+        conn.close()
+    return final_results
@@ -0,0 +1,82 @@
+import os
+
+# a sheet is small when its used range fits both limits, small sheets are answered from a rendered image
+SMALL_SHEET_MAX_ROWS = int(os.getenv('SMALL_SHEET_MAX_ROWS', 40))
+SMALL_SHEET_MAX_COLS = int(os.getenv('SMALL_SHEET_MAX_COLS', 10))
+# how many leading non-empty rows are considered when looking for the header
+HEADER_SCAN_ROWS = int(os.getenv('HEADER_SCAN_ROWS', 10))
+
+def is_blank(value):
+    return value is None or (isinstance(value, str) and value.strip() == '')
+
+def looks_like_header(values, used_cols):
+    # every filled cell is text and the row covers at least half of the used columns
+    filled = [value for value in values if not is_blank(value)]
+    return len(filled) > 0 and all(isinstance(value, str) for value in filled) and 2 * len(filled) >= used_cols
+
+def classify_sheet(used_rows, used_cols, max_rows=SMALL_SHEET_MAX_ROWS, max_cols=SMALL_SHEET_MAX_COLS):
+    if used_rows == 0:
+        return 'empty'
+    if used_rows <= max_rows and used_cols <= max_cols:
+        return 'small'
+    return 'big'
+
+def profile_sheet(sheet):
+    # a single pass over the cell values. The used range ends at the last row and column holding a value,
+    # so trailing rows and columns that only carry formatting do not count towards the size
+    declared = {"max_row": sheet.max_row, "max_column": sheet.max_column}
+    if hasattr(sheet, 'reset_dimensions'):
+        # read-only sheets stop at the declared <dimension>, which writers often get wrong or leave at A1;
+        # after a reset every row in the file is read, here and by everything reading this sheet later
+        sheet.reset_dimensions()
+    first_row = last_row = last_col = 0
+    filled_cells = 0
+    leading_rows = []
+    for row_idx, row in enumerate(sheet.iter_rows(values_only=True), start=1):
+        row_last_col = 0
+        for col_idx, value in enumerate(row, start=1):
+            if not is_blank(value):
+                filled_cells += 1
+                row_last_col = col_idx
+        if row_last_col == 0:
+            continue
+        first_row = first_row or row_idx
+        last_row = row_idx
+        last_col = max(last_col, row_last_col)
+        if len(leading_rows) < HEADER_SCAN_ROWS:
+            leading_rows.append((row_idx, row))
+
+    used_rows = last_row - first_row + 1 if last_row else 0
+    header_row = first_row
+    for row_idx, row in leading_rows:
+        if looks_like_header(row, last_col):
+            header_row = row_idx
+            break
+
+    return {
+        "sheet_name": sheet.title,
+        "sheet_state": getattr(sheet, 'sheet_state', 'visible'),
+        "dimensions": declared,
+        "used_range": {"first_row": first_row, "last_row": last_row, "last_column": last_col},
+        "used_rows": used_rows,
+        "used_columns": last_col,
+        "filled_cells": filled_cells,
+        "density": round(filled_cells / (used_rows * last_col), 4) if used_rows else 0.0,
+        "header_row": header_row,
+        "classification": classify_sheet(used_rows, last_col)
+    }
+
+def profile_workbook(workbook):
+    return {sheet.title: profile_sheet(sheet) for sheet in workbook}
+
+def sheets_by_class(workbook, profiles, classification):
+    return [sheet for sheet in workbook if profiles[sheet.title]['classification'] == classification]
+
+def pdf_page_mapping(profiles):
+    # libreoffice leaves hidden and empty sheets out of a pdf export, so page positions only count the
+    # sheets it prints; hidden sheets get no position
+    pages = {}
+    for sheet_name, profile in profiles.items():
+        if profile['sheet_state'] == 'visible' and profile['classification'] != 'empty':
+            pages[sheet_name] = len(pages) + 1
+    return pages
@@ -0,0 +1,115 @@
+import os
+import json
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+from openpyxl.utils import get_column_letter, range_boundaries
+from lib.ingest import sqlite_value
+
+# how small sheets reach small_sheet_query_agent:
+#   image  - every small sheet as a rendered image, as before
+#   text   - every small sheet as a markdown grid, nothing is rendered
+#   hybrid - markdown grids, plus images only for sheets whose layout text cannot carry (charts, shapes,
+#            pictures, conditional formatting)
+SMALL_SHEET_MODE = os.getenv('SMALL_SHEET_MODE', 'hybrid')
+
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+def sheet_xml_paths(zf):
+    # sheet name -> worksheet part inside the xlsx zip, resolved through the workbook relationships
+    workbook = ET.fromstring(zf.read('xl/workbook.xml'))
+    rels = ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+    targets = {rel.get('Id'): rel.get('Target') for rel in rels.iter(f'{PACKAGE_REL_NS}Relationship')}
+    paths = {}
+    for sheet in workbook.iter(f'{MAIN_NS}sheet'):
+        target = targets.get(sheet.get(f'{REL_NS}id'))
+        if target is None:
+            continue
+        paths[sheet.get('name')] = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+    return paths
+
+def sheet_layout(zf, xml_path):
+    # merged ranges plus the layout features a text grid cannot carry
+    layout = {"merged": [], "reasons": []}
+    for _, element in ET.iterparse(zf.open(xml_path)):
+        tag = element.tag.replace(MAIN_NS, '')
+        if tag == 'mergeCell':
+            layout['merged'].append(element.get('ref'))
+        elif tag == 'drawing' and 'drawing' not in layout['reasons']:
+            layout['reasons'].append('drawing')
+        elif tag == 'conditionalFormatting' and 'conditional_formatting' not in layout['reasons']:
+            layout['reasons'].append('conditional_formatting')
+        element.clear()
+    return layout
+
+def cell_text(value):
+    value = sqlite_value(value)
+    if value is None:
+        return ''
+    return ' '.join(str(value).split()).replace('|', '\\|')
+
+def sheet_grid(sheet, merged):
+    grid = [[cell_text(value) for value in row] for row in sheet.iter_rows(values_only=True)]
+    # a merged range shows its value in every cell it covers, so a spanning header labels each column below it
+    for ref in merged:
+        min_col, min_row, max_col, max_row = range_boundaries(ref)
+        if min_row > len(grid) or min_col > len(grid[min_row - 1]):
+            continue
+        anchor = grid[min_row - 1][min_col - 1]
+        for row_idx in range(min_row - 1, min(max_row, len(grid))):
+            row = grid[row_idx]
+            row.extend([''] * (max_col - len(row)))
+            for col_idx in range(min_col - 1, max_col):
+                row[col_idx] = anchor
+    return grid
+
+def grid_markdown(grid):
+    # rows and columns keep their sheet labels (3, C) so answers can point at cells; empty ones are dropped
+    width = max((len(row) for row in grid), default=0)
+    grid = [row + [''] * (width - len(row)) for row in grid]
+    rows = [idx for idx, row in enumerate(grid) if any(row)]
+    cols = [idx for idx in range(width) if any(grid[row][idx] for row in rows)]
+    if not rows:
+        return ''
+    lines = ['| | ' + ' | '.join(get_column_letter(col + 1) for col in cols) + ' |', '|---|' + '---|' * len(cols)]
+    for row in rows:
+        lines.append(f'| {row + 1} | ' + ' | '.join(grid[row][col] for col in cols) + ' |')
+    return '\n'.join(lines)
+
+def serialize_small_sheets(workbook, file_path, sheet_names, output_file):
+    # one entry per small sheet with its markdown grid and whether it still needs an image; returns output_file
+    with zipfile.ZipFile(file_path) as zf:
+        xml_paths = sheet_xml_paths(zf)
+        entries = []
+        for sheet_name in sheet_names:
+            layout = sheet_layout(zf, xml_paths[sheet_name]) if sheet_name in xml_paths else {"merged": [], "reasons": ['unreadable_layout']}
+            text = grid_markdown(sheet_grid(workbook[sheet_name], layout['merged']))
+            entries.append({
+                "sheet_name": sheet_name,
+                "text": text,
+                "chars": len(text),
+                "merged_ranges": len(layout['merged']),
+                "needs_image": len(layout['reasons']) > 0,
+                "reasons": layout['reasons']
+            })
+    with open(output_file, 'w') as f:
+        json.dump(entries, f, indent=2)
+    return output_file
+
+def sheets_needing_images(entries, mode=SMALL_SHEET_MODE):
+    if mode == 'image':
+        return [entry['sheet_name'] for entry in entries]
+    if mode == 'text':
+        return []
+    return [entry['sheet_name'] for entry in entries if entry['needs_image']]
+
+def sheets_as_text(entries, imaged_sheets=(), mode=SMALL_SHEET_MODE):
+    # a sheet that should have been an image but got none (no soffice, a failed export) keeps its grid
+    # rather than dropping out of small sheet answering
+    if mode == 'text':
+        return entries
+    if mode == 'image':
+        return [entry for entry in entries if entry['sheet_name'] not in imaged_sheets]
+    return [entry for entry in entries if not entry['needs_image'] or entry['sheet_name'] not in imaged_sheets]
@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import queue
+import atexit
+import shutil
+import tempfile
+import pathlib
+import threading
+import subprocess
+
+# pyuno ships with libreoffice rather than pip, without it every conversion goes through the cli
+try:
+    import uno
+    from com.sun.star.connection import NoConnectException
+except ImportError:
+    uno = None
+
+# long-lived headless listeners, one profile directory each so instances never share a lock file
+SOFFICE_BINARY = os.getenv('SOFFICE_BINARY', 'soffice')
+SOFFICE_POOL_SIZE = int(os.getenv('SOFFICE_POOL_SIZE', 2))
+SOFFICE_TIMEOUT = float(os.getenv('SOFFICE_TIMEOUT', 120))
+SOFFICE_START_TIMEOUT = float(os.getenv('SOFFICE_START_TIMEOUT', 30))
+SOFFICE_PROFILE_DIR = os.path.abspath(os.getenv('SOFFICE_PROFILE_DIR', 'temp_files/soffice_profiles'))
+
+def pdf_export_filter(page_range=''):
+    # one page per sheet; PageRange limits the cli export to the given sheet positions
+    filter_data = {"SinglePageSheets": {"type": "boolean", "value": "true"}}
+    if page_range:
+        filter_data["PageRange"] = {"type": "string", "value": page_range}
+    return 'pdf:calc_pdf_Export:' + json.dumps(filter_data, separators=(',', ':'))
+
+pool_lock = threading.Lock()
+free_instances = queue.Queue()
+instances = []
+
+def file_url(path):
+    # uploaded names can hold spaces, '#', '%' or non-ascii characters, all of which must be escaped in a url
+    if uno is not None:
+        return uno.systemPathToFileUrl(os.path.abspath(path))
+    return pathlib.Path(os.path.abspath(path)).as_uri()
+
+def property_value(name, value):
+    prop = uno.createUnoStruct('com.sun.star.beans.PropertyValue')
+    prop.Name = name
+    prop.Value = value
+    return prop
+
+def start_instance(instance_id):
+    profile = f'{SOFFICE_PROFILE_DIR}/{instance_id}'
+    pipe_name = f'excel_analysis_soffice_{os.getpid()}_{instance_id}'
+    process = subprocess.Popen([
+        SOFFICE_BINARY, '--headless', '--invisible', '--nologo', '--norestore', '--nodefault', '--nolockcheck',
+        f'-env:UserInstallation={file_url(profile)}',
+        f'--accept=pipe,name={pipe_name};urp;StarOffice.ComponentContext'
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    local_context = uno.getComponentContext()
+    resolver = local_context.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver', local_context)
+    deadline = time.monotonic() + SOFFICE_START_TIMEOUT
+    while True:
+        try:
+            context = resolver.resolve(f'uno:pipe,name={pipe_name};urp;StarOffice.ComponentContext')
+            break
+        except NoConnectException:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError(f'soffice instance {instance_id} did not start')
+            time.sleep(0.25)
+    desktop = context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+    return {"id": instance_id, "process": process, "desktop": desktop, "conversions": 0}
+
+def stop_instance(instance):
+    try:
+        instance['desktop'].terminate()
+    except Exception:
+        pass
+    try:
+        instance['process'].wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        instance['process'].kill()
+
+def restart_instance(instance):
+    print(f"Restarting soffice instance {instance['id']}")
+    instance['process'].kill()
+    try:
+        instance['process'].wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        pass
+    try:
+        instance.update(start_instance(instance['id']))
+    except Exception as e:
+        # an instance that does not come back leaves the pool for good, once none are left ensure_pool
+        # starts a fresh set and conversions go through the cli meanwhile
+        print(f"Error: soffice instance {instance['id']} failed to restart: {e}")
+        with pool_lock:
+            instances[:] = [other for other in instances if other is not instance]
+        return False
+    return True
+
+def ensure_pool():
+    # instances start lazily on the first conversion, a failed start leaves the pool smaller
+    with pool_lock:
+        if instances or uno is None or SOFFICE_POOL_SIZE <= 0:
+            return len(instances) > 0
+        for instance_id in range(SOFFICE_POOL_SIZE):
+            try:
+                instance = start_instance(instance_id)
+            except Exception as e:
+                print(f"Error: soffice instance {instance_id} failed to start: {e}")
+                continue
+            instances.append(instance)
+            free_instances.put(instance)
+        return len(instances) > 0
+
+def uno_convert(instance, input_file, output_file, sheet_names=None):
+    # the loaded copy drops every sheet that is not exported, the file on disk is never written back
+    document = instance['desktop'].loadComponentFromURL(file_url(input_file), '_blank', 0, (property_value('Hidden', True),))
+    try:
+        if sheet_names is not None:
+            for name in list(document.Sheets.ElementNames):
+                if name not in sheet_names:
+                    document.Sheets.removeByName(name)
+                else:
+                    document.Sheets.getByName(name).IsVisible = True
+        filter_data = uno.Any('[]com.sun.star.beans.PropertyValue', (property_value('SinglePageSheets', True),))
+        document.storeToURL(file_url(output_file), (property_value('FilterName', 'calc_pdf_Export'), property_value('FilterData', filter_data)))
+    finally:
+        document.close(True)
+
+def pool_convert(input_file, output_file, sheet_names=None, timeout=SOFFICE_TIMEOUT):
+    # waits for a free instance, a conversion running past the deadline kills and restarts its instance
+    deadline = time.monotonic() + timeout
+    try:
+        instance = free_instances.get(timeout=timeout)
+    except queue.Empty:
+        raise TimeoutError('No soffice instance became free in time')
+    outcome = {}
+
+    def run():
+        try:
+            uno_convert(instance, input_file, output_file, sheet_names)
+        except Exception as e:
+            outcome['error'] = e
+
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    worker.join(max(deadline - time.monotonic(), 0))
+    alive = True
+    try:
+        if worker.is_alive():
+            alive = restart_instance(instance)
+            raise TimeoutError(f'soffice conversion of {os.path.basename(input_file)} timed out')
+        if instance['process'].poll() is not None:
+            alive = restart_instance(instance)
+            raise outcome.get('error') or RuntimeError('soffice instance crashed')
+        if 'error' in outcome:
+            raise outcome['error']
+        instance['conversions'] += 1
+    finally:
+        if alive:
+            free_instances.put(instance)
+    return output_file
+
+def cli_convert(input_file, outdir, page_range='', timeout=SOFFICE_TIMEOUT):
+    # one-off process with a throwaway profile, so concurrent cli conversions do not block each other
+    profile = tempfile.mkdtemp(prefix='soffice_profile_')
+    try:
+        subprocess.run([SOFFICE_BINARY,
+                        '--headless',
+                        f'-env:UserInstallation={file_url(profile)}',
+                        '--convert-to', pdf_export_filter(page_range),
+                        input_file,
+                        '--outdir', outdir], timeout=timeout)
+    finally:
+        shutil.rmtree(profile, ignore_errors=True)
+
+def convert_workbook_pdf(input_file, outdir, sheets=None):
+    # sheets maps sheet name, in workbook order, to its 1-based page in a full pdf export (None for a hidden
+    # sheet) and limits the export to those sheets, one page each. The uno path unhides what it keeps, the
+    # cli path can only pick printed pages and leaves hidden sheets out, see pdf_sheet_order.
+    # Returns (pdf path or None, seconds taken, 'uno' or 'cli')
+    output_file = os.path.join(outdir, os.path.splitext(os.path.basename(input_file))[0] + '.pdf')
+    start = time.perf_counter()
+    method = 'cli'
+    if ensure_pool():
+        try:
+            pool_convert(input_file, output_file, None if sheets is None else list(sheets))
+            method = 'uno'
+        except Exception as e:
+            print(f"Error: soffice pool conversion failed, falling back to the cli: {e}")
+    if method == 'cli':
+        try:
+            cli_convert(input_file, outdir, '' if sheets is None else ','.join(str(sheets[name]) for name in pdf_sheet_order(sheets, method)))
+        except (subprocess.TimeoutExpired, OSError) as e:
+            print(f"Error: soffice cli conversion of {input_file} failed: {e}")
+    elapsed = time.perf_counter() - start
+    if not os.path.exists(output_file):
+        return None, elapsed, method
+    return output_file, elapsed, method
+
+def pdf_sheet_order(sheets, method):
+    # the sheets of convert_workbook_pdf's output in page order
+    if method == 'uno':
+        return list(sheets)
+    return sorted([name for name in sheets if sheets[name] is not None], key=lambda name: sheets[name])
+
+def pool_stats():
+    return {
+        "enabled": uno is not None and SOFFICE_POOL_SIZE > 0,
+        "instances": [{"id": instance['id'], "alive": instance['process'].poll() is None, "conversions": instance['conversions']} for instance in instances],
+        "free": free_instances.qsize()
+    }
+
+def shutdown_pool():
+    with pool_lock:
+        for instance in instances:
+            stop_instance(instance)
+        instances.clear()
+
+atexit.register(shutdown_pool)
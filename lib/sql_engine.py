@@ -0,0 +1,73 @@
+import os
+import time
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from lib.ingest import open_readonly
+
+# generated sql runs on pooled read-only connections; each statement gets a wall clock deadline,
+# enforced from sqlite's progress handler, and at most SQL_MAX_ROWS rows are fetched
+SQL_TIMEOUT = float(os.getenv('SQL_TIMEOUT', 10))
+SQL_MAX_ROWS = int(os.getenv('SQL_MAX_ROWS', 200))
+SQL_POOL_SIZE = int(os.getenv('SQL_POOL_SIZE', 4))
+SQL_MMAP_MB = int(os.getenv('SQL_MMAP_MB', 256))
+# virtual machine instructions between deadline checks
+PROGRESS_STEPS = 10000
+
+def sql_pool(db_path, size=SQL_POOL_SIZE):
+    # connections are opened on first use, up to size of them; dropping the pool closes them
+    return {"db_path": db_path, "size": max(1, size), "opened": 0, "idle": queue.LifoQueue(), "lock": threading.Lock()}
+
+def acquire_connection(pool):
+    try:
+        return pool['idle'].get_nowait()
+    except queue.Empty:
+        pass
+    with pool['lock']:
+        can_open = pool['opened'] < pool['size']
+        if can_open:
+            pool['opened'] += 1
+    if can_open:
+        conn = open_readonly(pool['db_path'])
+        conn.execute(f'PRAGMA mmap_size = {SQL_MMAP_MB * 1024 * 1024}')
+        return conn
+    return pool['idle'].get()
+
+def release_connection(pool, conn):
+    pool['idle'].put(conn)
+
+def run_query(pool, query, max_rows=SQL_MAX_ROWS, timeout=SQL_TIMEOUT):
+    # returns {"columns", "rows", "row_count", "truncated", "elapsed"}, or the same with an "error"
+    conn = acquire_connection(pool)
+    start = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, PROGRESS_STEPS)
+    outcome = {"columns": [], "rows": [], "row_count": 0, "truncated": False}
+    try:
+        cursor = conn.execute(query)
+        try:
+            outcome['columns'] = [column[0] for column in cursor.description or []]
+            rows = cursor.fetchmany(max_rows + 1)
+        finally:
+            cursor.close()
+        outcome['truncated'] = len(rows) > max_rows
+        outcome['rows'] = rows[:max_rows]
+        outcome['row_count'] = len(outcome['rows'])
+    except sqlite3.OperationalError as e:
+        outcome['error'] = f'Query timed out after {timeout}s' if str(e) == 'interrupted' else str(e)
+    except Exception as e:
+        # sqlite errors, and anything the query writer handed back that is not a statement (None, a dict)
+        outcome['error'] = str(e)
+    finally:
+        conn.set_progress_handler(None, 0)
+        release_connection(pool, conn)
+    outcome['elapsed'] = round(time.perf_counter() - start, 4)
+    return outcome
+
+def run_queries(pool, queries, max_rows=SQL_MAX_ROWS, timeout=SQL_TIMEOUT):
+    # independent queries run side by side, each on its own connection; results keep the input order
+    if not queries:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(queries), pool['size'])) as executor:
+        return list(executor.map(lambda query: run_query(pool, query, max_rows, timeout), queries))
@@ -0,0 +1,55 @@
+import os
+from PIL import Image, ImageDraw, ImageFont
+
+# sample tables are drawn in-process with Pillow instead of through a headless browser. In 'text' mode
+# no image is made at all and the query writer gets the sample as a markdown table
+SAMPLE_RENDER_MODE = os.getenv('SAMPLE_RENDER_MODE', 'image')
+SAMPLE_ROWS = int(os.getenv('SAMPLE_ROWS', 5))
+TABLE_FONT_PATH = os.getenv('TABLE_FONT_PATH', '')
+TABLE_FONT_SIZE = int(os.getenv('TABLE_FONT_SIZE', 14))
+TABLE_MAX_CELL_CHARS = int(os.getenv('TABLE_MAX_CELL_CHARS', 40))
+CELL_PADDING_X = 8
+CELL_PADDING_Y = 5
+GRID_COLOR = (200, 200, 200)
+HEADER_FILL = (235, 235, 235)
+TEXT_COLOR = (0, 0, 0)
+
+def table_font():
+    if TABLE_FONT_PATH and os.path.exists(TABLE_FONT_PATH):
+        return ImageFont.truetype(TABLE_FONT_PATH, TABLE_FONT_SIZE)
+    return ImageFont.load_default(size=TABLE_FONT_SIZE)
+
+def cell_text(value, max_chars=TABLE_MAX_CELL_CHARS):
+    text = '' if value is None else ' '.join(str(value).split())
+    if len(text) > max_chars:
+        return text[:max_chars - 1] + '…'
+    return text
+
+def render_table_image(columns, rows, output_file):
+    font = table_font()
+    table = [[cell_text(column) for column in columns]] + [[cell_text(value) for value in row] for row in rows]
+    measure = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+    ascent, descent = font.getmetrics()
+    row_height = ascent + descent + 2 * CELL_PADDING_Y
+    col_widths = [
+        max(int(measure.textlength(line[col], font=font)) for line in table) + 2 * CELL_PADDING_X
+        for col in range(len(columns))
+    ]
+
+    image = Image.new('RGB', (sum(col_widths) + 1, row_height * len(table) + 1), 'white')
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([0, 0, image.width - 1, row_height], fill=HEADER_FILL)
+    for row_idx, line in enumerate(table):
+        x = 0
+        top = row_idx * row_height
+        for col, text in enumerate(line):
+            draw.rectangle([x, top, x + col_widths[col], top + row_height], outline=GRID_COLOR)
+            draw.text((x + CELL_PADDING_X, top + CELL_PADDING_Y), text, fill=TEXT_COLOR, font=font)
+            x += col_widths[col]
+    image.save(output_file)
+    return output_file
+
+def markdown_table(columns, rows, max_chars=TABLE_MAX_CELL_CHARS):
+    def line(values):
+        return '| ' + ' | '.join(cell_text(value, max_chars).replace('|', '\\|') for value in values) + ' |'
+    return '\n'.join([line(columns), '|' + '---|' * len(columns)] + [line(row) for row in rows])
@@ -0,0 +1,102 @@
+import os
+import re
+import time
+import fcntl
+import hashlib
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_SPOOL_DIR = 'temp_files/uploads'
+# chunked uploads nobody finished are removed once they have not grown for this long
+UPLOAD_SPOOL_TTL_HOURS = float(os.getenv('UPLOAD_SPOOL_TTL_HOURS', 24))
+
+class UploadTooLarge(ValueError):
+    pass
+
+def max_upload_bytes():
+    return int(float(os.getenv('MAX_UPLOAD_MB', 500)) * 1024 * 1024)
+
+def safe_filename(filename):
+    # client supplied names keep only their last path component, so they can never leave the upload directory
+    name = os.path.basename((filename or '').replace('\\', '/').replace('\0', '')).strip()
+    return '' if name in ('.', '..') else name
+
+def copy_stream(stream, f, size, max_bytes, chunk_size=UPLOAD_CHUNK_SIZE):
+    # copy the request stream to an open file in fixed-size chunks, hashing in the same pass
+    md5 = hashlib.md5()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge(f'Upload exceeds the {max_bytes // (1024 * 1024)} MB limit')
+        md5.update(chunk)
+        view = memoryview(chunk)
+        while view:
+            view = view[f.write(view):]
+    return md5.hexdigest(), size
+
+def stream_upload(stream, dest_path, max_bytes=None, chunk_size=UPLOAD_CHUNK_SIZE):
+    if max_bytes is None:
+        max_bytes = max_upload_bytes()
+    with open(dest_path, 'wb') as f:
+        return copy_stream(stream, f, 0, max_bytes, chunk_size)
+
+def upload_spool_path(upload_id):
+    # upload ids are client supplied, keep them to a safe charset
+    if not re.fullmatch(r'[A-Za-z0-9_-]{1,64}', upload_id or ''):
+        return None
+    return f'{UPLOAD_SPOOL_DIR}/{upload_id}.part'
+
+def upload_offset(upload_id):
+    spool_path = upload_spool_path(upload_id)
+    if spool_path is None or not os.path.exists(spool_path):
+        return None
+    return os.path.getsize(spool_path)
+
+def expire_upload_spools(max_age_hours=UPLOAD_SPOOL_TTL_HOURS, spool_dir=UPLOAD_SPOOL_DIR):
+    # the mtime of a spool moves with every appended chunk, so only abandoned uploads age out
+    if not os.path.isdir(spool_dir):
+        return 0
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for name in os.listdir(spool_dir):
+        path = os.path.join(spool_dir, name)
+        try:
+            if name.endswith('.part') and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            # finished or removed by another request in the meantime
+            continue
+    return removed
+
+def append_upload_chunk(upload_id, offset, stream, max_bytes=None):
+    # append one chunk of a resumable upload, the client has to send chunks in order
+    spool_path = upload_spool_path(upload_id)
+    if spool_path is None:
+        raise ValueError('Invalid upload id')
+    if max_bytes is None:
+        max_bytes = max_upload_bytes()
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    if not os.path.exists(spool_path):
+        # every new upload sweeps the spools earlier clients abandoned
+        expire_upload_spools()
+    # unbuffered, so nothing is left to flush after a failed chunk is truncated away
+    with open(spool_path, 'ab', buffering=0) as f:
+        # the offset check and the append happen under one lock, a retried chunk racing the original
+        # sees the offset the first one left behind and is turned away
+        fcntl.flock(f, fcntl.LOCK_EX)
+        current_offset = os.fstat(f.fileno()).st_size
+        if offset != current_offset:
+            return current_offset, False
+        try:
+            _, size = copy_stream(stream, f, current_offset, max_bytes)
+        except UploadTooLarge:
+            os.remove(spool_path)
+            raise
+        except Exception:
+            # a chunk that broke off half way is dropped entirely, the client resends it from offset
+            os.ftruncate(f.fileno(), offset)
+            raise
+    return size, True
@@ -0,0 +1,89 @@
+import os
+import json
+import threading
+import contextvars
+from lib.llm_gateway import usage_value
+
+# token usage is collected in memory while a request runs and written to llm_usage.json once at the end;
+# running per-cuuid and global totals are kept alongside so rollups never touch the disk. Each request
+# gets its own run list through a context variable, since de-duplicated uploads share one cuuid and
+# several /ask requests on the same workbook can be in flight at once
+usage_lock = threading.Lock()
+usage_run = contextvars.ContextVar('usage_run', default=None)
+usage_totals = {}
+
+def cost_factors():
+    return float(os.environ.get("OPENAI_INPUT_COST", 0.01)), float(os.environ.get("OPENAI_OUTPUT_COST", 0.03))
+
+def usage_summary(run_name, input_tokens, output_tokens, total_tokens):
+    input_cost_factor, output_cost_factor = cost_factors()
+    input_cost = round(input_tokens / 1000 * input_cost_factor, 4)
+    output_cost = round(output_tokens / 1000 * output_cost_factor, 4)
+    total_cost = round(total_tokens / 1000 * (input_cost_factor + output_cost_factor), 4)
+    return {
+        "run_name": run_name,
+        "usage": {
+            "input_tokens": input_tokens,
+            "input_cost": f"${input_cost:.4f}",
+            "output_tokens": output_tokens,
+            "output_cost": f"${output_cost:.4f}",
+            "total_tokens": total_tokens,
+            "total_cost": f"${total_cost:.4f}"
+        }
+    }
+
+def add_to_totals(key, input_tokens, output_tokens, total_tokens):
+    totals = usage_totals.setdefault(key, {"calls": 0, "input_tokens": 0, "output_tokens": 0, "total_tokens": 0})
+    totals["calls"] += 1
+    totals["input_tokens"] += input_tokens
+    totals["output_tokens"] += output_tokens
+    totals["total_tokens"] += total_tokens
+
+def record_usage(run_name, usage, cuuid):
+    if usage is None:
+        return
+    input_tokens = usage_value(usage, 'prompt_tokens')
+    output_tokens = usage_value(usage, 'completion_tokens')
+    total_tokens = usage_value(usage, 'total_tokens')
+    run = usage_run.get()
+    with usage_lock:
+        if run is not None and run['cuuid'] == cuuid:
+            run['runs'].append(usage_summary(run_name, input_tokens, output_tokens, total_tokens))
+        add_to_totals(cuuid, input_tokens, output_tokens, total_tokens)
+        add_to_totals(None, input_tokens, output_tokens, total_tokens)
+
+def begin_usage(cuuid):
+    # starts collecting runs for the current request; hand the returned run to flush_usage at the end
+    run = {"cuuid": cuuid, "runs": []}
+    usage_run.set(run)
+    return run
+
+def flush_usage(run):
+    usage_run.set(None)
+    cuuid = run['cuuid']
+    with usage_lock:
+        runs = list(run['runs'])
+    if not runs or not os.path.isdir(f"temp_files/{cuuid}"):
+        return
+    runs.append(usage_summary(
+        "total_use",
+        sum(run["usage"]["input_tokens"] for run in runs),
+        sum(run["usage"]["output_tokens"] for run in runs),
+        sum(run["usage"]["total_tokens"] for run in runs)
+    ))
+    with open(f"temp_files/{cuuid}/llm_usage.json", "w") as file:
+        json.dump(runs, file, indent=2)
+
+def reset_usage(cuuid):
+    file_path = f"temp_files/{cuuid}/llm_usage.json"
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+def usage_rollup(cuuid=None):
+    with usage_lock:
+        totals = dict(usage_totals.get(cuuid, {"calls": 0, "input_tokens": 0, "output_tokens": 0, "total_tokens": 0}))
+    summary = usage_summary("total_use", totals["input_tokens"], totals["output_tokens"], totals["total_tokens"])["usage"]
+    summary["calls"] = totals["calls"]
+    if cuuid is not None:
+        summary["cuuid"] = cuuid
+    return summary
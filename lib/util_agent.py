@@ -1,81 +1,44 @@
 import os
 from dotenv import load_dotenv
 import pandas as pd
-from difflib import SequenceMatcher
 import requests
 import json
 import base64
-from openai import OpenAI
+import mimetypes
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from lib.llm_gateway import chat_completion
+from lib.log_writer import file_logger, reset_logs
+from lib.usage_tracker import record_usage, reset_usage
+from lib.search_index import search_index_lookup, best_substring_match
+from lib.cell_store import cell_store_lookup
+from lib.table_render import SAMPLE_RENDER_MODE
 
 load_dotenv()
-openai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+# fuzzy search results per (cuuid, search term, threshold), least recently used evicted first
+FUZZY_CACHE_SIZE = int(os.getenv('FUZZY_CACHE_SIZE', 256))
+fuzzy_search_cache = OrderedDict()
+fuzzy_search_cache_lock = threading.Lock()
 
-def usage_calculator_agent(run_name, usage, cuuid, total=False):
-    input_cost_factor = float(os.environ.get("OPENAI_INPUT_COST", 0.01))
-    output_cost_factor = float(os.environ.get("OPENAI_OUTPUT_COST", 0.03))
-
-    input_tokens = usage.prompt_tokens
-    input_cost = round(input_tokens / 1000 * input_cost_factor, 4)
-    output_tokens = usage.completion_tokens
-    output_cost = round(output_tokens / 1000 * output_cost_factor, 4)
-    total_tokens = usage.total_tokens
-    total_cost = round(total_tokens / 1000 * (input_cost_factor + output_cost_factor), 4)
-
-    run_data = {
-        "run_name": run_name,
-        "usage": {
-            "input_tokens": input_tokens,
-            "input_cost": f"${input_cost:.4f}",
-            "output_tokens": output_tokens,
-            "output_cost": f"${output_cost:.4f}",
-            "total_tokens": total_tokens,
-            "total_cost": f"${total_cost:.4f}"
-        }
-    }
-
-    file_path = f"temp_files/{cuuid}/llm_usage.json"
+# per-table query writer calls run concurrently, each bounded by a timeout in seconds
+QUERY_WRITER_CONCURRENCY = int(os.getenv('QUERY_WRITER_CONCURRENCY', 4))
+QUERY_WRITER_TIMEOUT = float(os.getenv('QUERY_WRITER_TIMEOUT', 60))
 
-    if os.path.exists(file_path):
-        with open(file_path, "r") as file:
-            data = json.load(file)
-    else:
-        data = []
+# search terms of the query correction few-shot examples, their substring lists are computed at index time
+QUERY_CORRECTION_FEWSHOT_TERMS = [
+    "TENDER-Construction of Internal Roads at Airport Showroom Zone at Duqm (Phase 1)",
+    "TENDER BOND NAME - Fishery Harbour At Khasab-Onshore Facilities and Associated Infrastrucutre-Construction of Fish Auctation Hall, Guard House and Boundary Wall",
+    "Civil Works for ESSAR at Duqm Refinery Phase 3 paCKAGE c (Tender)",
+]
 
-    data.append(run_data)
-
-    if total:
-        total_input_tokens = sum(run["usage"]["input_tokens"] for run in data)
-        total_output_tokens = sum(run["usage"]["output_tokens"] for run in data)
-        total_total_tokens = sum(run["usage"]["total_tokens"] for run in data)
-        total_input_cost = round(total_input_tokens / 1000 * input_cost_factor, 4)
-        total_output_cost = round(total_output_tokens / 1000 * output_cost_factor, 4)
-        total_total_cost = round(total_total_tokens / 1000 * (input_cost_factor + output_cost_factor), 4)
-
-        total_data = {
-            "run_name": "total_use",
-            "usage": {
-                "input_tokens": total_input_tokens,
-                "input_cost": f"${total_input_cost:.4f}",
-                "output_tokens": total_output_tokens,
-                "output_cost": f"${total_output_cost:.4f}",
-                "total_tokens": total_total_tokens,
-                "total_cost": f"${total_total_cost:.4f}"
-            }
-        }
-
-        data.append(total_data)
-
-    with open(file_path, "w") as file:
-        json.dump(data, file, indent=2)
+def encode_image(image_path):
+    with open(image_path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode('utf-8')
 
-def reset_usage(cuuid):
-    file_path = f"temp_files/{cuuid}/llm_usage.json"
-    if os.path.exists(file_path):
-        os.remove(file_path)
+def usage_calculator_agent(run_name, usage, cuuid):
+    record_usage(run_name, usage, cuuid)
 
 def return_total_usage_cost(cuuid):
     file_path = f"temp_files/{cuuid}/llm_usage.json"
@@ -93,13 +56,14 @@ def return_total_usage_cost(cuuid):
     else:
         return "No usage data found"
 
-def small_sheet_query_agent(question, message_image_array, cuuid):
+def small_sheet_query_agent(question, message_image_array, cuuid, sheet_texts=()):
     print("Running small sheet query agent")
     system_prompt = """
 You are an analytics bot that helps in analyzing documents.
 
 Keep the following in mind:
 - You will be given a set of documents and asked a question about them.
+- Documents come as images or as markdown grids whose first row holds the column letters and first column the row numbers of the sheet.
 - Answer only if you are confident about the answer. 
 - You will respond in a json format.
 - If the document does not contain the answer, just add "no_answer_found" to the answer key.
@@ -116,6 +80,11 @@ Respond in pure directly parsaable json format.
     question_frame = f"""
 Carefully review the attached images, tables and data.
 Based on the information provided, please answer the following question: " {question} "
+"""
+    for sheet_text in sheet_texts:
+        question_frame += f"""
+Sheet: {sheet_text['sheet_name']}
+{sheet_text['text']}
 """
     
     payload_messages = [
@@ -134,9 +103,8 @@ Based on the information provided, please answer the following question: " {ques
         }
     ]
 
-    response = openai_client.chat.completions.create(
-        model=os.getenv('OPENAI_GEN_MODEL'),
-        messages=payload_messages,
+    response = chat_completion(
+        payload_messages,
         temperature=0.3,
         response_format={"type": "json_object"}
     )
@@ -146,32 +114,52 @@ Based on the information provided, please answer the following question: " {ques
     return json.loads(response.choices[0].message.content)['answer']
 
 def find_approx_text(metadata, search_text, threshold=0.8):
-    csv_files = []
+    # metadata without a cuuid is still being indexed, its results are not worth keeping
+    cuuid = metadata.get('cuuid', '')
+    if not cuuid or FUZZY_CACHE_SIZE <= 0:
+        return scan_approx_text(metadata, search_text, threshold)
+
+    key = (cuuid, search_text, threshold)
+    with fuzzy_search_cache_lock:
+        if key in fuzzy_search_cache:
+            fuzzy_search_cache.move_to_end(key)
+            return list(fuzzy_search_cache[key])
+
+    results = scan_approx_text(metadata, search_text, threshold)
+    with fuzzy_search_cache_lock:
+        fuzzy_search_cache[key] = results
+        fuzzy_search_cache.move_to_end(key)
+        while len(fuzzy_search_cache) > FUZZY_CACHE_SIZE:
+            fuzzy_search_cache.popitem(last=False)
+    return list(results)
+
+def scan_approx_text(metadata, search_text, threshold=0.8):
+    # indexed workbooks only score the cells the search index or the cell store bounds shortlist
+    index_path = metadata['big_sheets'].get('search_index_path', '')
+    if index_path and os.path.exists(index_path):
+        return search_index_lookup(index_path, search_text, threshold)
+    cell_store_dir = metadata['big_sheets'].get('cell_store_dir', '')
+    if cell_store_dir and os.path.exists(f'{cell_store_dir}/manifest.json'):
+        return cell_store_lookup(cell_store_dir, search_text, threshold)
+
+    table_names = {}
     for file_path in metadata['big_sheets']['csv_file_meta']:
-        csv_files.append(file_path['csv_file_path'])
-    df_dict = {f: pd.read_csv(f) for f in csv_files}
+        table_names[file_path['csv_file_path']] = file_path['sheet_name']
+    df_dict = {f: pd.read_csv(f) for f in table_names}
     
     results = {}
     
     for filename, df in df_dict.items():
         for col in df.columns:
             for idx, row in df.iterrows():
-                cell_value = str(row[col])
-                words = cell_value.split()
-
-                for i in range(len(words)):
-                    for j in range(i+1, len(words)+1):
-                        substring = ' '.join(words[i:j])
-                        similarity = SequenceMatcher(None, search_text, substring).ratio()
-
-                        if similarity >= threshold:
-                            key = (filename, idx, col)
-                            if key not in results or similarity > results[key][1]:
-                                results[key] = (substring, similarity)
+                match = best_substring_match(search_text, str(row[col]), threshold)
+                if match is not None:
+                    results[(filename, idx, col)] = match
     final_results = []
     for (filename, idx, col), (substring, similarity) in results.items():
         final_results.append({
             'filename': filename,
+            'table_name': table_names[filename],
             'row': idx,
             'column': col,
             'substring': substring,
@@ -246,9 +234,8 @@ Following is a query to review and extract the search term:
         }
     ]
     
-    response = openai_client.chat.completions.create(
-        model=os.getenv('OPENAI_GEN_MODEL'),
-        messages=payload_messages,
+    response = chat_completion(
+        payload_messages,
         temperature=0.3,
         response_format={"type": "json_object"}
     )
@@ -265,10 +252,18 @@ def subterm_list(metadata, search_term):
         substrings_string += f'\n - "{substring}"'
     return substrings_string
 
+def fewshot_subterm_lists(metadata):
+    return {term: subterm_list(metadata, term) for term in QUERY_CORRECTION_FEWSHOT_TERMS}
+
+def fewshot_subterm_list(metadata, search_term):
+    precomputed = metadata['big_sheets'].get('fewshot_subterms', {})
+    if search_term in precomputed:
+        return precomputed[search_term]
+    return subterm_list(metadata, search_term)
+
 def table_list(metadata, search_term):
     approx_terms = find_approx_text(metadata, search_term)
-    tables = set([term['filename'] for term in approx_terms])
-    tables = set([table.split('/')[-1].split('.')[0] for table in tables])
+    tables = set([term['table_name'] for term in approx_terms])
     return tables
 
 def search_term_query_correction_agent(query, search_term, metadata, cuuid):
@@ -295,7 +290,7 @@ Respond in pure directly parsaable json format.
 "What was the issue date of tender bond for 'TENDER-Construction of Internal Roads at Airport Showroom Zone at Duqm (Phase 1)'?"
             
 Following are the possible correct search terms: 
-{subterm_list(metadata,"TENDER-Construction of Internal Roads at Airport Showroom Zone at Duqm (Phase 1)")}
+{fewshot_subterm_list(metadata, QUERY_CORRECTION_FEWSHOT_TERMS[0])}
 """,
             "search_term": "{\"query\": \"What was the issue date of tender bond for 'Construction of Internal Roads at Airport Showroom Zone at Duqm (Phase 1)'?\"}"
         },
@@ -304,7 +299,7 @@ Following are the possible correct search terms:
 "What is the expiry date of tender bond for “TENDER BOND NAME - Fishery Harbour At Khasab-Onshore Facilities and Associated Infrastrucutre-Construction of Fish Auctation Hall, Guard House and Boundary Wall”?"
 
 Following are the possible correct search terms:
-{subterm_list(metadata,"TENDER BOND NAME - Fishery Harbour At Khasab-Onshore Facilities and Associated Infrastrucutre-Construction of Fish Auctation Hall, Guard House and Boundary Wall")}
+{fewshot_subterm_list(metadata, QUERY_CORRECTION_FEWSHOT_TERMS[1])}
 """,
             "search_term": "{\"query\": \"What is the expiry date of tender bond for “Fishery Harbour At Khasab-Onshore Facilities and Associated Infrastrucutre-Construction of Fish Auctation Hall, Guard House and Boundary Wall”?\"}"
         },
@@ -313,7 +308,7 @@ Following are the possible correct search terms:
 "What was the tender received date for “Civil Works for ESSAR at Duqm Refinery Phase 3 paCKAGE c (Tender)”?"
 
 Following are the possible correct search terms:
-{subterm_list(metadata, "Civil Works for ESSAR at Duqm Refinery Phase 3 paCKAGE c (Tender)")}
+{fewshot_subterm_list(metadata, QUERY_CORRECTION_FEWSHOT_TERMS[2])}
 """,
             "search_term": "{\"query\": \"What was the tender received date for “Civil Works for ESSAR at Duqm Refinery Phase 3 paCKAGE c”?\"}"
         },
@@ -347,9 +342,8 @@ Following are the possible correct search terms:
         }
     ]
     
-    response = openai_client.chat.completions.create(
-        model=os.getenv('OPENAI_GEN_MODEL'),
-        messages=payload_messages,
+    response = chat_completion(
+        payload_messages,
         temperature=0.3,
         response_format={"type": "json_object"}
     )
@@ -358,17 +352,39 @@ Following are the possible correct search terms:
     usage_calculator_agent("search_term_query_correction_agent", response.usage, cuuid)
     return json.loads(response.choices[0].message.content)['query']
 
+def schema_lines(column_details):
+    # one compact line per column from the schema catalog; older catalogs lack some of the stats
+    lines = []
+    for column in column_details:
+        line = f'"{column["name"]}" {column.get("affinity", "TEXT")} {column.get("type", "text")}'
+        if column.get('null_ratio') is not None:
+            line += f', {column["null_ratio"]:.0%} empty'
+        if column.get('distinct') is not None:
+            line += f', {column["distinct"]} distinct'
+        if column.get('examples'):
+            line += f', e.g. {json.dumps(column["examples"], default=str)}'
+        lines.append(line)
+    return '\n'.join(lines)
+
+def query_writer_request(payload_messages):
+    return chat_completion(
+        payload_messages,
+        timeout=QUERY_WRITER_TIMEOUT,
+        temperature=0.3,
+        response_format={"type": "json_object"}
+    )
+
 def query_writer_agent(query, table_mapping, cuuid):
     print("Running query writer agent")
     system_prompt = """
 You are a SQL query bot that helps in querying the database.
 
 Things to note:
-- You will be given an image, table description from sqllite and a query to convert.
-- The image is a sample of the table in the database. (head of the table)
+- You will be given a sample of the table (an image or a markdown table), table description from sqllite and a query to convert.
+- The sample shows a few rows of the table in the database.
 - This sample will help you in understanding the table structure and column names.
 - Use your best judgement to formulate the SQL query based on the query provided.
-- The sample image should guide you in understanding the table data and things like what kind of data goes in which column to formulate the search/select query.
+- The sample should guide you in understanding the table data and things like what kind of data goes in which column to formulate the search/select query.
 - Write a SQL query to extract the required information from the table.
 - You will respond in a json format.
 - Encapculate all values in double quotes to garuntee the correct SQL query. (Table, Rows, Columns, Values, etc.)
@@ -388,6 +404,20 @@ Respond in pure directly parsaable json format.
     table_list = []
     for table_map in table_mapping:
         table_list.append(table_mapping[table_map]['table_name'])
+        sample_image = table_mapping[table_map].get('sample_image')
+        sample_markdown = table_mapping[table_map].get('sample_markdown')
+        if SAMPLE_RENDER_MODE == 'text' or not sample_image:
+            # the sample travels as a markdown table inside the prompt, no image is attached
+            sample_content = []
+            sample_text = f"\nSample rows:\n\n{sample_markdown}\n" if sample_markdown else ''
+        else:
+            sample_content = [{
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:{mimetypes.guess_type(sample_image)[0] or 'image/png'};base64,{encode_image(sample_image)}"
+                }
+            }]
+            sample_text = ''
         multi_payload_messages.append([
             {
                 "role": "system",
@@ -399,47 +429,55 @@ Respond in pure directly parsaable json format.
                     {
                         "type": "text",
                         "text": f"""
-Carefully review the attached image and table structure.
+Carefully review the table sample and table structure.
 Based on the information provided, please formulate an SQL query for the following query: 
 " {query} "
 
 Table details:
 
 Name: {table_mapping[table_map]['table_name']}
+Rows: {table_mapping[table_map]['row_count']}
 
-Columns:
+Columns (name, sqlite type, inferred type, share of empty cells, distinct values, examples):
 ```
-{json.dumps(table_mapping[table_map]['column_details'], indent=4)}
+{schema_lines(table_mapping[table_map]['column_details'])}
 ```
-"""
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{encode_image(table_mapping[table_map]['sample_image'])}"
-                        }
+{sample_text}"""
                     }
-                ]    
+                ] + sample_content
             }
         ])
 
+    # one call per routed table, sent concurrently; results keep the table order
+    executor = ThreadPoolExecutor(max_workers=max(1, QUERY_WRITER_CONCURRENCY))
+    futures = [executor.submit(query_writer_request, payload_messages) for payload_messages in multi_payload_messages]
+    rounds = -(-len(futures) // max(1, QUERY_WRITER_CONCURRENCY))
+    wait(futures, timeout=QUERY_WRITER_TIMEOUT * rounds)
+    executor.shutdown(wait=False, cancel_futures=True)
+
     multi_sql_queries = []
-    i = 0
-    for payload_messages in multi_payload_messages:
+    for i, (future, payload_messages) in enumerate(zip(futures, multi_payload_messages)):
         file_logger(f"query_writer_agent_{i}_payload", payload_messages, cuuid)
-        response = openai_client.chat.completions.create(
-            model=os.getenv('OPENAI_GEN_MODEL'),
-            messages=payload_messages,
-            temperature=0.3,
-            response_format={"type": "json_object"}
-        )
+        try:
+            if not future.done():
+                raise TimeoutError(f"query writer timed out after {QUERY_WRITER_TIMEOUT}s")
+            response = future.result()
+            sql_query = json.loads(response.choices[0].message.content)['query']
+        except Exception as e:
+            # a failed table must not abort the whole question, report it alongside the others
+            file_logger(f"query_writer_agent_{i}_error", repr(e), cuuid)
+            multi_sql_queries.append({
+                "table_name": table_list[i],
+                "query": None,
+                "error": str(e) or type(e).__name__
+            })
+            continue
         file_logger(f"query_writer_agent_{i}", response.model_dump_json(), cuuid)
         usage_calculator_agent(f"query_writer_agent_{i}", response.usage, cuuid)
         multi_sql_queries.append({
             "table_name": table_list[i],
-            "query": json.loads(response.choices[0].message.content)['query']
+            "query": sql_query
         })
-        i += 1
     return multi_sql_queries
 
 def response_humanizer_agent(query, final_response, cuuid):
@@ -458,6 +496,7 @@ Things to note:
 - The raw responses are generated by AI and may not be human readable.
 - You have to convert the raw responses to a more human readable format.
 - In case you see the response is a negative one or conveys that the answer is not found, you have to tell the user to try again or reformulate the query a little bit.
+- A large result may arrive summarized: its row_count, the first and last rows (head, tail) and per column aggregates. Answer from those and never invent rows that are not shown.
 
 """
 
@@ -519,50 +558,26 @@ Following is the raw response:
 
     file_logger("response_humanizer_agent - final_payload", payload_messages, cuuid)
 
-    streaming_response = openai_client.chat.completions.create(
-        model=os.getenv('OPENAI_GEN_MODEL'),
-        messages=payload_messages,
+    streaming_response = chat_completion(
+        payload_messages,
         temperature=0.3,
-        stream=True
+        stream=True,
+        # the final chunk carries the usage of the whole stream, it has no choices
+        extra_body={"stream_options": {"include_usage": True}}
     )
     complete_response = ""
+    stream_usage = None
     for chunk in streaming_response:
+        if getattr(chunk, 'usage', None) is not None:
+            stream_usage = chunk.usage
+        if not chunk.choices:
+            continue
         content = chunk.choices[0].delta.content
         if content is not None:
             yield json.dumps({'success': content, 'action': "response_stream"}).encode() + b"\n"
             complete_response += content
 
     file_logger("response_humanizer_agent", complete_response, cuuid)
-    # no usage stats for streaming responses
-    # usage_calculator_agent("response_humanizer_agent", last_chunk.usage, cuuid, total=True)
+    usage_calculator_agent("response_humanizer_agent", stream_usage, cuuid)
     yield json.dumps({'success': True, 'action': "response_stream_complete"}).encode() + b"\n"
     # return
-
-def file_logger(process_name, response_data, cuuid):
-    file_path = f"temp_files/{cuuid}/{cuuid}_logs.json"
-
-    if not isinstance(response_data, (str, dict, list)):
-        response_data = response_data.model_dump_json()
-
-    data = {
-        "timestamp": pd.Timestamp.now().isoformat(),
-        "process": process_name,
-        "data": response_data
-    }
-    
-    # open the file and append the data, then save it
-    if os.path.exists(file_path):
-        with open(file_path, "r") as file:
-            logs = json.load(file)
-    else:
-        logs = []
-    
-    logs.append(data)
-    
-    with open(file_path, "w") as file:
-        json.dump(logs, file, indent=2)
-
-def reset_logs(cuuid):
-    file_path = f"temp_files/{cuuid}/{cuuid}_logs.json"
-    if os.path.exists(file_path):
-        os.remove(file_path)
@@ -1,79 +1,65 @@
 import base64
 import os
-import pandas as pd
+import sqlite3
 import subprocess
-import dataframe_image as dfi
+from lib.table_render import render_table_image, SAMPLE_ROWS
+
+# small sheet pages are rasterized for legibility to the vision model, not for print: 150 dpi keeps
+# cell text crisp and the longest side is capped so a wide sheet does not turn into a huge image
+RASTER_DPI = int(os.getenv('RASTER_DPI', 150))
+RASTER_MAX_SIDE = int(os.getenv('RASTER_MAX_SIDE', 2000))
 
-def is_sheet_small(sheet, max_rows=40, max_cols=10, return_big_sheets=False):
-    if sheet.max_row == 1 and sheet.max_column == 1 and sheet.cell(row=1, column=1).value is None:
-        return False
-    if return_big_sheets:
-        return sheet.max_row > max_rows or sheet.max_column > max_cols
-    return sheet.max_row <= max_rows and sheet.max_column <= max_cols
-            
 def encode_image(image_path):
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode('utf-8')
 
-def convert_to_pdf(input_file, current_uuid):
-    import subprocess
-    subprocess.run(['soffice',
-                    '--headless',
-                    '--convert-to', 'pdf:calc_pdf_Export:{"SinglePageSheets":{"type":"boolean","value":"true"}}',
-                    input_file,
-                    '--outdir', f'temp_files/{current_uuid}/'])
-    
-    output_file = input_file.replace('.xlsx', '.pdf')
-    # check if output file exists
-    if not os.path.exists(output_file):
-        return None
-    return output_file
-                
 def page_number_mapping(sheet_names):
     return {sheet_name: idx+1 for idx, sheet_name in enumerate(sheet_names)}
 
-def get_img_from_pg_num(pdf_file, pg_num, page_mapping, current_uuid):
-    # find sheet name from page number
-    sheet_name = None
-    for name, num in page_mapping.items():
-        if num == pg_num:
-            sheet_name = name
-            break
-    output_file = f'temp_files/{current_uuid}/sheet_{sheet_name}_{pg_num}.png'
+def rasterize_pdf_pages(pdf_file, sheet_names, page_mapping, current_uuid):
+    # page i of the pdf is sheet_names[i]; every page goes through a single convert call, trimmed and
+    # capped in size, then renamed after its sheet. Returns {sheet name: image path or None}
+    images = {sheet_name: None for sheet_name in sheet_names}
+    if pdf_file is None or not sheet_names:
+        return images
+    pattern = f'temp_files/{current_uuid}/small_sheet_page_%d.png'
     subprocess.run(['convert',
-                    '-density', '300',
-                    '-trim',
+                    '-density', str(RASTER_DPI),
+                    f'{pdf_file}[0-{len(sheet_names) - 1}]',
+                    '-trim', '+repage',
+                    '-resize', f'{RASTER_MAX_SIDE}x{RASTER_MAX_SIDE}>',
                     '-quality', '100',
-                    f'{pdf_file}[{pg_num-1}]',
-                    output_file])
-    if not os.path.exists(output_file):
-        print('Error: Image file not created')
-        return
-    return output_file
+                    pattern])
+    for idx, sheet_name in enumerate(sheet_names):
+        page_file = pattern % idx
+        if not os.path.exists(page_file):
+            print(f'Error: Image file not created for sheet {sheet_name}')
+            continue
+        output_file = f'temp_files/{current_uuid}/sheet_{sheet_name}_{page_mapping[sheet_name]}.png'
+        os.replace(page_file, output_file)
+        images[sheet_name] = output_file
+    return images
 
-def convert_to_csv(sheet, file_path):
-    # first row is the header
-    df = pd.DataFrame(sheet.values)
-    df.columns = df.iloc[0]
-    df = df[1:]
-    df = df.dropna(axis=1, how='all')
-    df = df.dropna(axis=0, how='all')
-    df.to_csv(file_path, index=False)
-    if not os.path.exists(file_path):
-        print('Error: CSV file not created')
-        return
-    return file_path
+def quote_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+def sample_table_rows(db_path, table_name, limit=SAMPLE_ROWS):
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.execute(f'SELECT * FROM {quote_identifier(table_name)} ORDER BY RANDOM() LIMIT {int(limit)}')
+        return [column[0] for column in cursor.description], cursor.fetchall()
+    finally:
+        conn.close()
 
-def get_img_from_csv(csv_file, pg_num, page_mapping, current_uuid):
+def get_img_from_db(db_path, table_name, pg_num, page_mapping, current_uuid, sample=None):
     sheet_name = None
     for name, num in page_mapping.items():
         if num == pg_num:
             sheet_name = name
             break
-    df = pd.read_csv(csv_file)
-    sample_df = df.sample(n=5)
+    columns, rows = sample if sample is not None else sample_table_rows(db_path, table_name)
     output_file = f'temp_files/{current_uuid}/sample_sheet_{sheet_name}_{pg_num}.png'
-    dfi.export(sample_df, output_file, max_cols=-1, table_conversion="selenium")
+    render_table_image(columns, rows, output_file)
     if not os.path.exists(output_file):
         print('Error: Image file not created')
         return
@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+import openai
+import httpx
+from lib import llm_gateway
+
+# a local OpenAI-compatible stub: each request takes the next scripted status, once the script runs out
+# every request gets a 200 completion that echoes the prompt back
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['content-length'])))
+        server = self.server
+        with server.lock:
+            server.seen.append(body['messages'][-1]['content'])
+            status = server.script.pop(0) if server.script else 200
+        if status != 200:
+            payload = json.dumps({"error": {"message": f"stub {status}", "type": "stub"}}).encode()
+            self.send_response(status)
+            self.send_header('retry-after', '0')
+        else:
+            payload = json.dumps({
+                "id": "stub", "object": "chat.completion", "created": 0, "model": body['model'],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": body['messages'][-1]['content']}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+            }).encode()
+            self.send_response(200)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+class LlmGatewayTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.lock = threading.Lock()
+        self.server.script = []
+        self.server.seen = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.saved = {name: getattr(llm_gateway, name) for name in ['llm_client', 'LLM_MAX_CONCURRENCY', 'LLM_MAX_RETRIES', 'LLM_RETRY_BASE_DELAY']}
+        llm_gateway.llm_client = openai.OpenAI(api_key='test', base_url=f'http://127.0.0.1:{self.server.server_port}/v1', max_retries=0, http_client=httpx.Client(timeout=10))
+        llm_gateway.LLM_RETRY_BASE_DELAY = 0.01
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(llm_gateway, name, value)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def ask(self, prompt, **kwargs):
+        response = llm_gateway.chat_completion([{"role": "user", "content": prompt}], model='stub', **kwargs)
+        return response.choices[0].message.content
+
+    def test_retries_rate_limits_and_server_errors(self):
+        self.server.script = [429, 503]
+        before = llm_gateway.gateway_stats()
+        self.assertEqual(self.ask('hello'), 'hello')
+        after = llm_gateway.gateway_stats()
+        self.assertEqual(len(self.server.seen), 3)
+        self.assertEqual(after['retries'] - before['retries'], 2)
+        self.assertEqual(after['rate_limited'] - before['rate_limited'], 1)
+
+    def test_gives_up_after_max_retries(self):
+        llm_gateway.LLM_MAX_RETRIES = 1
+        self.server.script = [500, 500, 500]
+        with self.assertRaises(openai.InternalServerError):
+            self.ask('hello')
+        self.assertEqual(len(self.server.seen), 2)
+        # the failed call gave its slot back
+        self.assertEqual(llm_gateway.in_flight, 0)
+
+    def test_waiting_calls_run_in_priority_order(self):
+        llm_gateway.LLM_MAX_CONCURRENCY = 1
+        # hold the only slot so every call below has to queue
+        llm_gateway.acquire_slot(llm_gateway.PRIORITY_INTERACTIVE, 0)
+        threads = []
+        for prompt, priority in [('later-1', 10), ('later-2', 10), ('now', llm_gateway.PRIORITY_INTERACTIVE)]:
+            thread = threading.Thread(target=self.ask, args=(prompt,), kwargs={"priority": priority})
+            thread.start()
+            threads.append(thread)
+            # wait until the call is queued, so arrival order is fixed
+            deadline = time.monotonic() + 5
+            while len(llm_gateway.waiting_queue) < len(threads) and time.monotonic() < deadline:
+                time.sleep(0.01)
+        llm_gateway.release_slot(0)
+        for thread in threads:
+            thread.join(timeout=10)
+        self.assertEqual(self.server.seen, ['now', 'later-1', 'later-2'])
+
+if __name__ == '__main__':
+    unittest.main()